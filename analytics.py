@@ -0,0 +1,206 @@
+import glob
+import os
+import threading
+import time
+
+import numpy as np
+
+from database import get_db_connection, release_db_connection
+
+# Columnar copy of batting_scores for per-innings analytics. Rows are sorted by
+# (player_id, match_date, innings_id), so one player's innings are a contiguous,
+# chronological slice found by binary search on the player_id column.
+BATTING_DTYPE = np.dtype([
+    ('player_id', '<i4'),
+    ('innings_id', '<i4'),
+    ('match_day', '<i4'),
+    ('runs', '<i2'),
+    ('balls', '<i2'),
+    ('fours', '<i2'),
+    ('sixes', '<i2'),
+    ('is_out', 'u1'),
+    ('position', 'u1'),
+    ('dismissal', 'u1'),
+])
+
+DISMISSALS = ['Not Out', 'Bowled', 'Caught', 'LBW', 'Run Out', 'Stumped', 'Hit Wicket', 'Other']
+_DISMISSAL_CODES = {name.lower(): code for code, name in enumerate(DISMISSALS)}
+
+# Dismissal codes worked out by SQLite, so rows load straight into the array
+_DISMISSAL_SQL = 'CASE WHEN NOT COALESCE(bs.is_out, 0) THEN {} {} ELSE {} END'.format(
+    _DISMISSAL_CODES['not out'],
+    ' '.join(f"WHEN LOWER(bs.dismissal_type) = '{name}' THEN {code}"
+             for name, code in _DISMISSAL_CODES.items() if name not in ('not out', 'other')),
+    _DISMISSAL_CODES['other'],
+)
+
+FORM_WINDOW = 5
+
+# A write only schedules a background reload, at most one per this many seconds;
+# dashboards keep using the previous store meanwhile
+REFRESH_SECONDS = float(os.environ.get('CRICKET_ANALYTICS_REFRESH', 5))
+
+class ColumnStore:
+    def __init__(self, batting, version):
+        self.batting = batting
+        self.version = version
+
+    @staticmethod
+    def from_database():
+        conn = get_db_connection()
+        version = _global_version(conn)
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        rows = cursor.execute(f'''
+            SELECT bs.player_id,
+                   bs.innings_id,
+                   CAST(julianday(m.match_date) - 2440587.5 AS INTEGER),
+                   COALESCE(bs.runs_scored, 0),
+                   COALESCE(bs.balls_faced, 0),
+                   COALESCE(bs.fours, 0),
+                   COALESCE(bs.sixes, 0),
+                   COALESCE(bs.is_out, 0),
+                   COALESCE(bs.batting_position, 0),
+                   {_DISMISSAL_SQL}
+            FROM batting_scores bs
+            JOIN innings i ON bs.innings_id = i.id
+            JOIN matches m ON i.match_id = m.id
+            ORDER BY bs.player_id, m.match_date, bs.innings_id
+        ''')
+        return ColumnStore(np.fromiter(rows, dtype=BATTING_DTYPE), version)
+
+    def save(self, path):
+        tmp_path = f'{path}.tmp.npy'
+        np.save(tmp_path, self.batting)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path, version):
+        return ColumnStore(np.load(path, mmap_mode='r'), version)
+
+    def _rows(self, player_ids):
+        # Indexes of each player's innings, chronological within a player
+        player_ids = np.asarray(sorted(set(player_ids)), dtype='<i4')
+        column = self.batting['player_id']
+        starts = np.searchsorted(column, player_ids, side='left')
+        ends = np.searchsorted(column, player_ids, side='right')
+        if not len(player_ids):
+            return player_ids, starts, ends, np.empty(0, dtype=np.intp)
+        lengths = ends - starts
+        # Vectorized concatenation of the [start, end) ranges
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return player_ids, starts, ends, np.arange(lengths.sum()) + offsets
+
+    def rolling_average(self, player_ids, window=FORM_WINDOW):
+        # Runs per innings averaged over each player's last `window` innings,
+        # computed for every innings of every requested player in one pass
+        ids, starts, ends, index = self._rows(player_ids)
+        if not len(ids):
+            return {}
+        runs = self.batting['runs'][index].astype(np.int64)
+        lengths = ends - starts
+        group_start = np.repeat(np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        position = np.arange(len(index))
+        window_start = np.maximum(position - window + 1, group_start)
+        totals = np.concatenate(([0], np.cumsum(runs)))
+        averages = (totals[position + 1] - totals[window_start]) / (position - window_start + 1)
+        bounds = np.cumsum(lengths)
+        return {
+            int(player_id): (runs[bound - length:bound], averages[bound - length:bound])
+            for player_id, length, bound in zip(ids, lengths, bounds)
+        }
+
+    def current_form(self, player_ids, window=FORM_WINDOW):
+        # Average runs over each player's most recent `window` innings
+        return {player_id: round(float(averages[-1]), 2) if len(averages) else 0.0
+                for player_id, (_, averages) in self.rolling_average(player_ids, window).items()}
+
+    def strike_rate_by_position(self, player_ids):
+        _, _, _, index = self._rows(player_ids)
+        rows = self.batting[index]
+        runs = np.bincount(rows['position'], weights=rows['runs'], minlength=12)
+        balls = np.bincount(rows['position'], weights=rows['balls'], minlength=12)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            strike_rates = np.where(balls > 0, runs * 100 / balls, np.nan)
+        return {int(position): round(float(strike_rates[position]), 2)
+                for position in np.flatnonzero(balls) if position > 0}
+
+    def dismissal_breakdown(self, player_ids):
+        _, _, _, index = self._rows(player_ids)
+        counts = np.bincount(self.batting['dismissal'][index], minlength=len(DISMISSALS))
+        return {DISMISSALS[code]: int(count) for code, count in enumerate(counts) if count}
+
+def _global_version(conn):
+    row = conn.execute("SELECT version FROM data_versions WHERE scope = 'global'").fetchone()
+    return row['version'] if row else 0
+
+_store = None
+_store_lock = threading.Lock()
+_reload = {'running': False, 'started': 0.0}
+
+def _load(version):
+    # With CRICKET_ANALYTICS_SNAPSHOT set, the columns are also written to a
+    # snapshot file per version and memory-mapped by every process that needs
+    # that version, instead of each one re-reading the tables
+    snapshot = os.environ.get('CRICKET_ANALYTICS_SNAPSHOT')
+    path = f'{snapshot}.v{version}.npy' if snapshot else None
+    if path and os.path.exists(path):
+        return ColumnStore.load(path, version)
+    store = ColumnStore.from_database()
+    if path and store.version == version:
+        store.save(path)
+        for old_path in glob.glob(f'{glob.escape(snapshot)}.v*.npy'):
+            if old_path != path:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+    return store
+
+def _reload_store():
+    global _store
+    try:
+        store = _load(_global_version(get_db_connection()))
+        with _store_lock:
+            # A page render may have loaded a newer store meanwhile
+            if _store is None or store.version > _store.version:
+                _store = store
+    finally:
+        release_db_connection()
+        with _store_lock:
+            _reload['running'] = False
+
+def get_store(wait=False):
+    # Only the first call waits for a load, and calls with wait=True, which
+    # prerender.py makes so a stored page is never older than its version.
+    # Otherwise a write that moves the global data version on starts a reload
+    # in a background thread and the current store keeps answering until the
+    # new one is swapped in.
+    global _store
+    version = _global_version(get_db_connection())
+    store = _store
+    if store is None or wait and store.version < version:
+        with _store_lock:
+            if _store is None or wait and _store.version < version:
+                _store = _load(version)
+            return _store
+    if store.version != version:
+        with _store_lock:
+            if _reload['running'] or time.monotonic() - _reload['started'] < REFRESH_SECONDS:
+                return store
+            _reload.update(running=True, started=time.monotonic())
+        threading.Thread(target=_reload_store, name='analytics-reload', daemon=True).start()
+    return store
+
+def store_version():
+    # Version of the store the dashboards are using right now, for their ETags
+    store = _store
+    return None if store is None else store.version
+
+def _reset_after_fork():
+    global _store_lock
+    _store_lock = threading.Lock()
+    _reload['running'] = False
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,36 +1,189 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-import plotly.graph_objs as go
-import plotly.utils
+from flask import Blueprint, Flask, Response, request, redirect, url_for, flash, jsonify, abort, make_response, session, g
+from datetime import date, datetime, timedelta, timezone
+from functools import wraps
+from werkzeug.http import is_resource_modified
+import base64
+import binascii
+import hashlib
 import json
-from database import init_db
-from models import Team, Player, Match, Innings, BattingScore, BowlingFigure, Partnership
+import sqlite3
+import time
+import flask
+import charts
+import database
+import metrics
+import prerender
+import snapshot
+from cache import stats_cache
+from database import configure, init_db, release_db_connection, set_connection_factory
+import live
+from live import broadcaster, format_sse
+import models
+from models import Team, Player, Match, Innings, DataVersion, Delivery, Leaderboard
 
-app = Flask(__name__)
-app.secret_key = 'cricket_dashboard_secret_key_2024'
+bp = Blueprint('dashboard', __name__)
 
-# Initialize database
-init_db()
+def start_request_metrics():
+    metrics.begin_request()
 
-@app.route('/')
+def record_request_metrics(response):
+    # Labelled by URL rule rather than path so the number of series stays bounded
+    metrics.end_request(request.url_rule.rule if request.url_rule else 'unmatched', response.status_code)
+    return response
+
+def route_reads():
+    # Reads go to the snapshot unless this session wrote within the snapshot's
+    # staleness bound, so a scorer always sees their own changes
+    if snapshot.PATH is None:
+        return
+    if request.method not in ('GET', 'HEAD'):
+        session['_wrote_at'] = time.time()
+    snapshot.pin_primary(time.time() - session.get('_wrote_at', 0) <= snapshot.MAX_AGE)
+
+def render_template(template_name, **context):
+    with metrics.timer(metrics.template_seconds, template_name):
+        return flask.render_template(template_name, **context)
+
+def _cache_info():
+    return {(name, field): value
+            for name, cache in (('stats', stats_cache), ('chart', charts.chart_cache))
+            for field, value in cache.info().items() if value is not None}
+
+metrics.register(metrics.Gauge('cricket_cache', 'Cache sizes and hit/miss/eviction counters',
+                               ('cache', 'field'), _cache_info))
+metrics.register(metrics.Gauge('cricket_live_subscribers', 'Open live score streams', (),
+                               lambda: {(): broadcaster.subscriber_count()}))
+
+def versioned(scopes, extra=None):
+    # Conditional GET driven by the data_versions counters: scopes(**view_args)
+    # names what the view depends on, extra() anything else that goes into the
+    # ETag, and a matching If-None-Match or If-Modified-Since is answered with
+    # 304 before the view runs
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            versions = g.data_versions = DataVersion.get(scopes(**kwargs))
+            tag = f'{request.full_path}|{sorted(versions.items())}'
+            if extra is not None:
+                tag = f'{tag}|{extra()}'
+            etag = hashlib.sha1(tag.encode()).hexdigest()
+            changed = [updated_at for _, updated_at in versions.values() if updated_at]
+            last_modified = None
+            if changed:
+                last_modified = datetime.strptime(max(changed), '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+            
+            # Pending flash messages must be rendered, so never short-circuit those
+            if not session.get('_flashes') and not is_resource_modified(
+                    request.environ, etag=etag, last_modified=last_modified):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(**kwargs))
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+def prerendered(kind):
+    # Serve a plain GET from the page prerender.py stored for the version
+    # versioned() just read; a page not rendered yet is rendered live and
+    # queued so the next request finds it
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if prerender.ROOT is None or request.args or session.get('_flashes'):
+                return view(**kwargs)
+            entity_id = kwargs[f'{kind}_id']
+            version = g.data_versions[f'{kind}:{entity_id}'][0]
+            response = prerender.serve(kind, entity_id, version, request.accept_encodings)
+            if response is not None:
+                return response
+            prerender.schedule([(kind, entity_id)])
+            return view(**kwargs)
+        return wrapper
+    return decorator
+
+def global_scope(**kwargs):
+    return ['global']
+
+def team_scope(team_id):
+    return [f'team:{team_id}']
+
+def player_scope(player_id):
+    return [f'player:{player_id}']
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def encode_cursor(after):
+    if after is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(after).encode()).decode()
+
+def decode_cursor(cursor, types):
+    # A cursor is the list of sort key values of the last row, one per type
+    if not cursor:
+        return None
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, binascii.Error):
+        abort(400, 'Invalid cursor')
+    if (not isinstance(after, list) or len(after) != len(types)
+            or not all(type(value) is expected for value, expected in zip(after, types))):
+        abort(400, 'Invalid cursor')
+    return after
+
+def page_args(*types):
+    limit = request.args.get('limit', PAGE_SIZE, type=int)
+    return decode_cursor(request.args.get('cursor'), types), max(1, min(limit, MAX_PAGE_SIZE))
+
+@bp.route('/')
+@versioned(global_scope)
 def index():
-    teams = Team.get_all()
-    players = Player.get_all()
-    matches = Match.get_all()
-    return render_template('index.html', teams=teams, players=players, matches=matches)
+    # Only the first page of each list; the rest is fetched with "Load more"
+    teams, teams_after = Team.get_page(limit=PAGE_SIZE)
+    players, players_after = Player.get_page(limit=PAGE_SIZE)
+    matches, matches_after = Match.get_page(limit=PAGE_SIZE)
+    return render_template('index.html', teams=teams, players=players, matches=matches,
+                           teams_cursor=encode_cursor(teams_after),
+                           players_cursor=encode_cursor(players_after),
+                           matches_cursor=encode_cursor(matches_after))
+
+@bp.route('/api/teams')
+@versioned(global_scope)
+def list_teams():
+    after, limit = page_args(str)
+    teams, next_after = Team.get_page(after, limit)
+    return jsonify({'items': [dict(t) for t in teams], 'next_cursor': encode_cursor(next_after)})
+
+@bp.route('/api/players')
+@versioned(global_scope)
+def list_players():
+    after, limit = page_args(str, str)
+    players, next_after = Player.get_page(after, limit)
+    return jsonify({'items': [dict(p) for p in players], 'next_cursor': encode_cursor(next_after)})
 
-@app.route('/add_team', methods=['GET', 'POST'])
+@bp.route('/api/matches')
+@versioned(global_scope)
+def list_matches():
+    after, limit = page_args(str, int)
+    matches, next_after = Match.get_page(after, limit)
+    return jsonify({'items': [dict(m) for m in matches], 'next_cursor': encode_cursor(next_after)})
+
+@bp.route('/add_team', methods=['GET', 'POST'])
 def add_team():
     if request.method == 'POST':
         name = request.form['name']
         try:
             Team.create(name)
             flash(f'Team "{name}" added successfully!', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('dashboard.index'))
         except Exception as e:
             flash(f'Error adding team: {str(e)}', 'error')
     return render_template('add_team.html')
 
-@app.route('/add_player', methods=['GET', 'POST'])
+@bp.route('/add_player', methods=['GET', 'POST'])
 def add_player():
     teams = Team.get_all()
     if request.method == 'POST':
@@ -40,34 +193,33 @@ def add_player():
         try:
             Player.create(name, team_id, role)
             flash(f'Player "{name}" added successfully!', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('dashboard.index'))
         except Exception as e:
             flash(f'Error adding player: {str(e)}', 'error')
     return render_template('add_player.html', teams=teams)
 
-@app.route('/add_score', methods=['GET', 'POST'])
+@bp.route('/add_score', methods=['GET', 'POST'])
 def add_score():
     teams = Team.get_all()
     matches = Match.get_all()
     
     if request.method == 'POST':
-        # Create match if new
+        # A new match is created together with the scorecard
         if request.form.get('new_match') == 'yes':
             team1_id = request.form['team1_id']
             team2_id = request.form['team2_id']
             match_date = request.form['match_date']
             venue = request.form['venue']
-            match_id = Match.create(team1_id, team2_id, match_date, venue)
+            match_id, new_match = None, (team1_id, team2_id, match_date, venue)
         else:
-            match_id = request.form['match_id']
+            match_id, new_match = request.form['match_id'], None
         
-        # Create innings
+        # Collect the scorecard
         batting_team_id = request.form['batting_team_id']
         bowling_team_id = request.form['bowling_team_id']
         innings_number = request.form['innings_number']
-        innings_id = Innings.create(match_id, batting_team_id, bowling_team_id, innings_number)
         
-        # Add batting scores
+        batting_scores = []
         batting_count = int(request.form.get('batting_count', 0))
         for i in range(batting_count):
             player_id = request.form.get(f'player_id_{i}')
@@ -78,15 +230,16 @@ def add_score():
                 sixes = int(request.form.get(f'sixes_{i}', 0))
                 is_out = request.form.get(f'is_out_{i}') == 'yes'
                 dismissal_type = request.form.get(f'dismissal_type_{i}') if is_out else None
-                bowler_id = request.form.get(f'bowler_id_{i}') if is_out else None
-                fielder_id = request.form.get(f'fielder_id_{i}') if is_out else None
+                # An unpicked bowler or fielder is posted as ''
+                bowler_id = (request.form.get(f'bowler_id_{i}') or None) if is_out else None
+                fielder_id = (request.form.get(f'fielder_id_{i}') or None) if is_out else None
                 partnership = int(request.form.get(f'partnership_{i}', 0))
                 
-                BattingScore.create(innings_id, player_id, runs, balls, fours, sixes,
-                                  is_out, dismissal_type, bowler_id, fielder_id, 
-                                  partnership, i+1)
+                batting_scores.append((player_id, runs, balls, fours, sixes,
+                                       is_out, dismissal_type, bowler_id, fielder_id,
+                                       partnership, i+1))
         
-        # Add bowling figures
+        bowling_figures = []
         bowling_count = int(request.form.get('bowling_count', 0))
         for i in range(bowling_count):
             bowler_id = request.form.get(f'bowler_pid_{i}')
@@ -96,95 +249,311 @@ def add_score():
                 runs_conceded = int(request.form.get(f'runs_conceded_{i}', 0))
                 wickets = int(request.form.get(f'wickets_{i}', 0))
                 
-                BowlingFigure.create(innings_id, bowler_id, overs, maidens, runs_conceded, wickets)
+                bowling_figures.append((bowler_id, overs, maidens, runs_conceded, wickets))
+        
+        # Write the match, the innings and all its rows in a single transaction
+        try:
+            Innings.create_scorecard(match_id, batting_team_id, bowling_team_id, innings_number,
+                                     batting_scores, bowling_figures, new_match)
+        except Exception as e:
+            flash(f'Error adding score: {str(e)}', 'error')
+            return render_template('add_score.html', teams=teams, matches=matches)
         
         flash('Score added successfully!', 'success')
-        return redirect(url_for('index'))
+        return redirect(url_for('dashboard.index'))
     
     return render_template('add_score.html', teams=teams, matches=matches)
 
-@app.route('/api/players/<int:team_id>')
+PLAYER_ROLES = ('Batsman', 'Bowler', 'All-rounder', 'Wicket-keeper')
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+
+@bp.route('/api/players/search')
+def search_players():
+    query = request.args.get('q', '').strip()
+    team_id = request.args.get('team_id', type=int)
+    role = request.args.get('role') or None
+    if role is not None and role not in PLAYER_ROLES:
+        abort(400, 'Unknown role')
+    limit = max(1, min(request.args.get('limit', SEARCH_LIMIT, type=int), MAX_SEARCH_LIMIT))
+    
+    players = Player.search(query, team_id, role, limit) if query else []
+    response = jsonify([dict(p) for p in players])
+    response.headers['Cache-Control'] = 'public, max-age=30'
+    response.add_etag(weak=True)
+    return response.make_conditional(request)
+
+@bp.route('/api/players/<int:team_id>')
+@versioned(team_scope)
 def get_team_players(team_id):
     players = Player.get_by_team(team_id)
     return jsonify([{'id': p['id'], 'name': p['name'], 'role': p['role']} for p in players])
 
-@app.route('/team/<int:team_id>')
+@bp.route('/api/innings/<int:innings_id>/deliveries', methods=['POST'])
+def add_deliveries(innings_id):
+    # Accepts one ball as a JSON object or a batch of balls as a JSON list
+    if Innings.get_by_id(innings_id) is None:
+        abort(404)
+    balls = request.get_json(silent=True)
+    if isinstance(balls, dict):
+        balls = [balls]
+    if not isinstance(balls, list) or not all(
+            isinstance(ball, dict) and ball.get('batsman_id') and ball.get('bowler_id') for ball in balls):
+        return jsonify({'error': 'Expected a ball or list of balls with batsman_id and bowler_id'}), 400
+    try:
+        delivery_ids = Delivery.create_many(innings_id, balls)
+    except (ValueError, sqlite3.Error) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'deliveries': delivery_ids, 'innings': dict(Innings.get_by_id(innings_id))}), 201
+
+LIVE_KEEPALIVE_SECONDS = 15
+
+def live_stream(*channels):
+    # Server-Sent Events feed; each client only holds a small bounded buffer in
+    # the broadcaster and is woken when a write publishes to one of its channels
+    if not live.ENABLED:
+        abort(404)
+    subscription = broadcaster.subscribe(*channels)
+    
+    def events():
+        # Streams end after MAX_STREAM_SECONDS; EventSource reconnects on its own
+        deadline = time.monotonic() + live.MAX_STREAM_SECONDS
+        try:
+            yield 'retry: 5000\n\n'
+            while time.monotonic() < deadline:
+                pending = subscription.get(timeout=min(LIVE_KEEPALIVE_SECONDS, deadline - time.monotonic()))
+                if not pending:
+                    yield ': keepalive\n\n'
+                for event, data in pending:
+                    yield format_sse(event, data)
+        finally:
+            broadcaster.unsubscribe(subscription)
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/stream/match/<int:match_id>')
+def match_stream(match_id):
+    return live_stream(f'match:{match_id}')
+
+@bp.route('/stream/team/<int:team_id>')
+def team_stream(team_id):
+    return live_stream(f'team:{team_id}')
+
+LEADERBOARD_SIZE = 10
+MAX_LEADERBOARD_SIZE = 100
+
+def leaderboard_args():
+    filters = {
+        'team_id': request.args.get('team_id', type=int),
+        'min_innings': max(1, request.args.get('min_innings', 1, type=int)),
+        'date_from': request.args.get('from') or None,
+        'date_to': request.args.get('to') or None,
+    }
+    for key in ('date_from', 'date_to'):
+        if filters[key]:
+            try:
+                datetime.strptime(filters[key], '%Y-%m-%d')
+            except ValueError:
+                abort(400, 'Dates must be YYYY-MM-DD')
+    return filters
+
+@bp.route('/leaderboard')
+@versioned(global_scope)
+def leaderboard():
+    filters = leaderboard_args()
+    boards = [(category, spec, Leaderboard.get(category, LEADERBOARD_SIZE, **filters))
+              for category, spec in Leaderboard.CATEGORIES.items()]
+    return render_template('leaderboard.html', boards=boards, filters=filters, teams=Team.get_all())
+
+@bp.route('/api/leaderboard/<category>')
+@versioned(global_scope)
+def leaderboard_api(category):
+    if category not in Leaderboard.CATEGORIES:
+        abort(404)
+    limit = max(1, min(request.args.get('limit', LEADERBOARD_SIZE, type=int), MAX_LEADERBOARD_SIZE))
+    return jsonify(Leaderboard.get(category, limit, **leaderboard_args()))
+
+@bp.route('/api/cache/stats')
+def cache_stats():
+    return jsonify(stats_cache.info())
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+PERIODS = {'all': 'All Time', 'season': 'This Season', '12m': 'Last 12 Months'}
+
+def period_args():
+    # Dashboard period filter as (period, extra positional args for the stats reads)
+    period = request.args.get('period', 'all')
+    today = date.today()
+    if period == 'season':
+        return period, (f'{today.year}-01-01', today.isoformat())
+    if period == '12m':
+        return period, ((today - timedelta(days=365)).isoformat(), today.isoformat())
+    if period != 'all':
+        abort(400, f"period must be one of {', '.join(PERIODS)}")
+    return period, ()
+
+def load_analytics():
+    # The form charts need NumPy; imported on first use, and without it the
+    # dashboards are served without those charts
+    try:
+        import analytics
+    except ImportError:
+        return None
+    return analytics
+
+def analytics_version():
+    # The form charts catch up with writes in the background, so a page shown
+    # with an older store gets a new ETag once the store is reloaded
+    analytics = load_analytics()
+    return None if analytics is None else analytics.store_version()
+
+@bp.route('/match/<int:match_id>')
+@versioned(global_scope)
+def match_scorecard(match_id):
+    scorecard = Match.get_scorecard(match_id)
+    if scorecard is None:
+        abort(404)
+    return render_template('match_scorecard.html', match=scorecard['match'], innings=scorecard['innings'])
+
+@bp.route('/api/matches/<int:match_id>')
+@versioned(global_scope)
+def match_scorecard_api(match_id):
+    scorecard = Match.get_scorecard(match_id)
+    if scorecard is None:
+        abort(404)
+    return jsonify(scorecard)
+
+@bp.route('/team/<int:team_id>')
+@versioned(team_scope, analytics_version)
+@prerendered('team')
 def team_dashboard(team_id):
     team = Team.get_by_id(team_id)
+    if team is None:
+        abort(404)
     players = Player.get_by_team(team_id)
-    team_stats = Team.get_statistics(team_id)
+    period, dates = period_args()
+    team_stats = Team.get_statistics(team_id, *dates)
     
     # Create visualizations
     player_names = [p['name'] for p in players]
-    player_runs = [Player.get_batting_stats(p['id']).get('total_runs', 0) for p in players]
-    player_wickets = [Player.get_bowling_stats(p['id']).get('total_wickets', 0) for p in players]
-    
-    # Runs bar chart
-    runs_chart = go.Figure(data=[
-        go.Bar(x=player_names, y=player_runs, marker_color='lightblue')
-    ])
-    runs_chart.update_layout(title='Total Runs by Player', xaxis_title='Player', yaxis_title='Runs')
-    runs_chart_json = json.dumps(runs_chart, cls=plotly.utils.PlotlyJSONEncoder)
+    player_stats = Player.get_stats_by_team(team_id, *dates)
+    no_stats = {'batting': {}, 'bowling': {}}
+    player_runs = [player_stats.get(p['id'], no_stats)['batting'].get('total_runs', 0) for p in players]
+    player_wickets = [player_stats.get(p['id'], no_stats)['bowling'].get('total_wickets', 0) for p in players]
     
-    # Wickets bar chart
-    wickets_chart = go.Figure(data=[
-        go.Bar(x=player_names, y=player_wickets, marker_color='lightcoral')
-    ])
-    wickets_chart.update_layout(title='Total Wickets by Player', xaxis_title='Player', yaxis_title='Wickets')
-    wickets_chart_json = json.dumps(wickets_chart, cls=plotly.utils.PlotlyJSONEncoder)
+    # Chart payloads are cached by the data they plot
+    with metrics.timer(metrics.chart_seconds, 'team_dashboard'):
+        runs_chart_json = charts.player_bar_chart('Total Runs by Player', 'Runs', tuple(player_names),
+                                                  tuple(player_runs), 'lightblue')
+        wickets_chart_json = charts.player_bar_chart('Total Wickets by Player', 'Wickets', tuple(player_names),
+                                                     tuple(player_wickets), 'lightcoral')
+
+        # Form and trend charts come from the columnar analytics store
+        form_chart_json = position_chart_json = None
+        analytics = load_analytics()
+        if analytics is not None:
+            store = analytics.get_store()
+            player_ids = [p['id'] for p in players]
+            form = store.current_form(player_ids)
+            form_chart_json = charts.player_bar_chart(f'Form (Average of Last {analytics.FORM_WINDOW} Innings)',
+                                                      'Runs', tuple(player_names),
+                                                      tuple(form[pid] for pid in player_ids), 'steelblue')
+            by_position = store.strike_rate_by_position(player_ids)
+            position_chart_json = charts.position_strike_rate_chart(tuple(by_position), tuple(by_position.values()))
     
     return render_template('team_dashboard.html', 
                          team=team, 
                          players=players,
                          team_stats=team_stats,
                          runs_chart=runs_chart_json,
-                         wickets_chart=wickets_chart_json)
+                         wickets_chart=wickets_chart_json,
+                         form_chart=form_chart_json,
+                         position_chart=position_chart_json,
+                         live_enabled=live.ENABLED,
+                         period=period,
+                         periods=PERIODS)
 
-@app.route('/player/<int:player_id>')
+@bp.route('/player/<int:player_id>')
+@versioned(player_scope, analytics_version)
+@prerendered('player')
 def player_dashboard(player_id):
     player = Player.get_by_id(player_id)
-    batting_stats = Player.get_batting_stats(player_id)
-    bowling_stats = Player.get_bowling_stats(player_id)
-    
-    # Batting pie chart (Runs distribution)
-    if batting_stats.get('total_runs', 0) > 0:
-        batting_pie = go.Figure(data=[go.Pie(
-            labels=['Boundaries (4s & 6s)', 'Singles & Doubles'],
-            values=[
-                (batting_stats.get('total_fours', 0) * 4) + (batting_stats.get('total_sixes', 0) * 6),
-                batting_stats.get('total_runs', 0) - ((batting_stats.get('total_fours', 0) * 4) + (batting_stats.get('total_sixes', 0) * 6))
-            ],
-            marker_colors=['#ff9999', '#66b3ff']
-        )])
-        batting_pie.update_layout(title='Runs Distribution')
-        batting_pie_json = json.dumps(batting_pie, cls=plotly.utils.PlotlyJSONEncoder)
-    else:
-        batting_pie_json = None
+    if player is None:
+        abort(404)
+    period, dates = period_args()
+    batting_stats = Player.get_batting_stats(player_id, *dates)
+    bowling_stats = Player.get_bowling_stats(player_id, *dates)
     
-    # Strike rate gauge
-    if batting_stats.get('strike_rate'):
-        sr_gauge = go.Figure(go.Indicator(
-            mode="gauge+number",
-            value=batting_stats.get('strike_rate', 0),
-            domain={'x': [0, 1], 'y': [0, 1]},
-            title={'text': "Strike Rate"},
-            gauge={'axis': {'range': [None, 200]},
-                   'bar': {'color': "darkblue"},
-                   'steps': [
-                       {'range': [0, 80], 'color': "lightgray"},
-                       {'range': [80, 120], 'color': "gray"},
-                       {'range': [120, 200], 'color': "lightgreen"}],
-                   'threshold': {'line': {'color': "red", 'width': 4}, 'thickness': 0.75, 'value': 150}}))
-        sr_gauge_json = json.dumps(sr_gauge, cls=plotly.utils.PlotlyJSONEncoder)
-    else:
-        sr_gauge_json = None
+    # Batting pie chart (Runs distribution) and strike rate gauge, cached by their inputs
+    with metrics.timer(metrics.chart_seconds, 'player_dashboard'):
+        batting_pie_json = charts.runs_distribution_pie(batting_stats.get('total_runs', 0),
+                                                        batting_stats.get('total_fours', 0),
+                                                        batting_stats.get('total_sixes', 0))
+        sr_gauge_json = charts.strike_rate_gauge(batting_stats.get('strike_rate'))
+
+        form_chart_json = dismissal_pie_json = None
+        analytics = load_analytics()
+        if analytics is not None:
+            store = analytics.get_store()
+            runs, averages = store.rolling_average([player_id])[player_id]
+            form_chart_json = charts.form_chart(tuple(runs.tolist()), tuple(averages.round(2).tolist()),
+                                                analytics.FORM_WINDOW)
+            dismissals = store.dismissal_breakdown([player_id])
+            dismissal_pie_json = charts.dismissal_pie(tuple(dismissals), tuple(dismissals.values()))
     
     return render_template('player_dashboard.html',
                          player=player,
                          batting_stats=batting_stats,
                          bowling_stats=bowling_stats,
                          batting_pie=batting_pie_json,
-                         sr_gauge=sr_gauge_json)
+                         sr_gauge=sr_gauge_json,
+                         form_chart=form_chart_json,
+                         dismissal_pie=dismissal_pie_json,
+                         period=period,
+                         periods=PERIODS)
+
+def create_app(config=None):
+    # The database, snapshot and prerender settings are process-wide, so only
+    # one app per process is supported: a later create_app() with other
+    # settings repoints every app already built, the module-level one included
+    app = Flask(__name__)
+    app.secret_key = 'cricket_dashboard_secret_key_2024'
+    if config:
+        app.config.update(config)
+    if app.config.get('DATABASE'):
+        configure(app.config['DATABASE'])
+    if app.config.get('SNAPSHOT'):
+        snapshot.configure(app.config['SNAPSHOT'])
+    app.config.update(DATABASE=database.DATABASE, SNAPSHOT=snapshot.PATH)
+    
+    # Time every SQL statement and count queries, rows and connections per request
+    if metrics.ENABLED:
+        set_connection_factory(metrics.TimedConnection, metrics.connection_checked_out)
+    
+    # Creates or migrates the schema only when its version is behind
+    init_db()
+    
+    # Hand the request's pooled connection back once the request is done
+    app.teardown_appcontext(release_db_connection)
+    app.teardown_appcontext(snapshot.release)
+    app.before_request(route_reads)
+    app.before_request(start_request_metrics)
+    app.after_request(record_request_metrics)
+    app.register_blueprint(bp)
+    
+    # Re-render the team and player pages each write touches
+    prerender.init_app(app, app.config.get('PRERENDER'))
+    app.config['PRERENDER'] = prerender.ROOT
+    if prerender.schedule not in models.write_listeners:
+        models.write_listeners.append(prerender.schedule)
+    return app
+
+# Built at import so `gunicorn --preload app:app` shares it across workers
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,326 @@
+import argparse
+import json
+import platform
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import database
+import metrics
+from import_scorecards import Loader
+
+# Synthetic data and repeatable benchmarks.
+#
+#   python benchmark.py generate --db bench.db --scale 1000000
+#   python benchmark.py run --db bench.db --out results.json [--compare baseline.json]
+#   python benchmark.py compare baseline.json results.json
+#
+# The generator is seeded, so the same --scale and --seed always produce the
+# same database. Scale counts batting and bowling rows; T20-style scorecards
+# give 32 of them per match. Matches go through the bulk importer's Loader so
+# the career, version and search triggers fire as they do in production.
+
+SQUAD = ['Batsman'] * 6 + ['Wicket-keeper'] * 2 + ['All-rounder'] * 3 + ['Bowler'] * 4
+DISMISSALS = [('Caught', 55), ('Bowled', 18), ('LBW', 12), ('Run Out', 8), ('Stumped', 5), ('Hit Wicket', 2)]
+ROWS_PER_MATCH = 2 * (11 + 5)
+
+def _squads(conn, team_count):
+    # Teams and players are created up front so players carry a role
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        first_team = conn.execute('SELECT COALESCE(MAX(id), 0) FROM teams').fetchone()[0] + 1
+        first_player = conn.execute('SELECT COALESCE(MAX(id), 0) FROM players').fetchone()[0] + 1
+        teams, players = [], []
+        for team_id in range(first_team, first_team + team_count):
+            teams.append((team_id, f'Team {team_id}'))
+            for number, role in enumerate(SQUAD, start=1):
+                players.append((first_player + len(players), f'Player {team_id}-{number}', team_id, role))
+        conn.executemany('INSERT INTO teams (id, name) VALUES (?, ?)', teams)
+        conn.executemany('INSERT INTO players (id, name, team_id, role) VALUES (?, ?, ?, ?)', players)
+    return {name: [player[1] for player in players if player[2] == team_id] for team_id, name in teams}
+
+def _innings(rng, number, batting_team, bowling_team, squads):
+    batters = squads[batting_team][:11]
+    bowlers = squads[bowling_team][-5:]
+    batting, wickets = [], 0
+    for position, name in enumerate(batters, start=1):
+        if wickets == 10:
+            break
+        runs = int(rng.expovariate(1 / max(6, 32 - 3 * position)))
+        balls = max(1, int(runs * 100 / max(60, rng.gauss(125, 25))))
+        sixes = int(runs * rng.uniform(0, 0.3)) // 6
+        fours = int((runs - sixes * 6) * rng.uniform(0.2, 0.6)) // 4
+        is_out = position < 11 and rng.random() < 0.8
+        dismissal = bowler = fielder = None
+        if is_out:
+            wickets += 1
+            dismissal = rng.choices([d for d, _ in DISMISSALS], [w for _, w in DISMISSALS])[0]
+            if dismissal != 'Run Out':
+                bowler = rng.choice(bowlers)
+            if dismissal in ('Caught', 'Run Out', 'Stumped'):
+                fielder = rng.choice(squads[bowling_team])
+        batting.append((name, runs, balls, fours, sixes, is_out, dismissal, bowler, fielder, position))
+
+    total_runs = sum(row[1] for row in batting) + rng.randint(0, 15)
+    credited = {}
+    for row in batting:
+        if row[7]:
+            credited[row[7]] = credited.get(row[7], 0) + 1
+    bowling, remaining = [], total_runs
+    for index, name in enumerate(bowlers):
+        conceded = remaining if index == len(bowlers) - 1 else min(remaining, int(total_runs / 5 * rng.uniform(0.6, 1.4)))
+        remaining -= conceded
+        bowling.append((name, 4.0, int(conceded < 12 and rng.random() < 0.3), conceded, credited.get(name, 0)))
+
+    return {
+        'innings_number': number,
+        'batting_team': batting_team,
+        'bowling_team': bowling_team,
+        'batting': batting,
+        'bowling': bowling,
+        'totals': {'runs': total_runs, 'wickets': wickets, 'balls': 120 if wickets < 10 else rng.randint(60, 120)},
+    }
+
+def generate(scale, seed=42, batch_rows=50000):
+    rng = random.Random(seed)
+    conn = database.get_db_connection()
+    match_count = max(1, scale // ROWS_PER_MATCH)
+    squads = _squads(conn, max(8, min(200, match_count // 500)))
+    team_names = list(squads)
+    first_day = date(2000, 1, 1)
+    days = (date(2025, 12, 31) - first_day).days
+    loader = Loader(conn)
+    started = time.monotonic()
+    for index in range(match_count):
+        team1, team2 = rng.sample(team_names, 2)
+        loader.add({
+            'match_date': (first_day + timedelta(days=index * days // match_count)).isoformat(),
+            'venue': f'Ground {rng.randint(1, 40)}',
+            'team1': team1,
+            'team2': team2,
+            'innings': [_innings(rng, 1, team1, team2, squads), _innings(rng, 2, team2, team1, squads)],
+        })
+        if loader.pending_rows >= batch_rows:
+            loader.flush()
+            print(f'{loader.matches}/{match_count} matches, {loader.rows} rows, '
+                  f'{loader.rows / (time.monotonic() - started):,.0f} rows/s', file=sys.stderr)
+    loader.flush()
+    conn.execute('ANALYZE')
+    return loader.matches, loader.rows
+
+class QueryCounter:
+    # Statements executed through the metrics cursor, one per execute() or
+    # executemany() call. SQLite's trace callback would also report every
+    # trigger step, as another copy of the statement that fired it.
+    def __init__(self):
+        self._start = metrics.sql_seconds.count()
+
+    def reset(self):
+        self._start = metrics.sql_seconds.count()
+
+    @property
+    def count(self):
+        return metrics.sql_seconds.count() - self._start
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def _measure(call, iterations, counter, cold):
+    from cache import stats_cache
+    from charts import chart_cache
+
+    timings = []
+    counter.reset()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        if cold:
+            stats_cache.clear()
+            chart_cache.clear()
+        call_started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'p50_ms': round(_percentile(timings, 0.50) * 1000, 3),
+        'p95_ms': round(_percentile(timings, 0.95) * 1000, 3),
+        'p99_ms': round(_percentile(timings, 0.99) * 1000, 3),
+        'mean_ms': round(sum(timings) / iterations * 1000, 3),
+        'queries_per_call': round(counter.count / iterations, 2),
+        'throughput_per_s': round(iterations / elapsed, 1),
+    }
+
+def _scorecard_form(rng, match, batting_team, bowling_team, batters, bowlers):
+    form = {'new_match': 'no', 'match_id': match, 'batting_team_id': batting_team,
+            'bowling_team_id': bowling_team, 'innings_number': 1,
+            'batting_count': len(batters), 'bowling_count': len(bowlers)}
+    for i, player_id in enumerate(batters):
+        runs = rng.randint(0, 80)
+        form.update({f'player_id_{i}': player_id, f'runs_{i}': runs, f'balls_{i}': runs + 5,
+                     f'fours_{i}': runs // 12, f'sixes_{i}': runs // 30})
+    for i, player_id in enumerate(bowlers):
+        form.update({f'bowler_pid_{i}': player_id, f'overs_{i}': 4, f'maidens_{i}': 0,
+                     f'runs_conceded_{i}': rng.randint(15, 50), f'wickets_{i}': rng.randint(0, 3)})
+    return form
+
+def scenarios(rng, writes=True):
+    from app import app
+    from models import Innings, Leaderboard, Match, Player, Team
+
+    conn = database.get_db_connection()
+    team_ids = [row[0] for row in conn.execute('SELECT id FROM teams ORDER BY id')]
+    player_ids = [row[0] for row in conn.execute('SELECT id FROM players ORDER BY id')]
+    match_rows = conn.execute('SELECT id, team1_id, team2_id FROM matches ORDER BY id').fetchall()
+    squads = {team_id: [row[0] for row in conn.execute(
+        'SELECT id FROM players WHERE team_id = ? ORDER BY id', (team_id,))] for team_id in team_ids}
+    database.release_db_connection()
+    if not team_ids or not match_rows:
+        raise SystemExit('database is empty; run "benchmark.py generate" first')
+    client = app.test_client()
+
+    def get(url):
+        def call():
+            path = url() if callable(url) else url
+            response = client.get(path)
+            if response.status_code != 200:
+                raise RuntimeError(f'{path}: HTTP {response.status_code}')
+        return call
+
+    def model(method, *args):
+        def call():
+            method(*(arg() for arg in args))
+            database.release_db_connection()
+        return call
+
+    def add_score():
+        match_id, team1, team2 = rng.choice(match_rows)
+        form = _scorecard_form(rng, match_id, team1, team2, squads[team1][:11], squads[team2][-5:])
+        response = client.post('/add_score', data=form)
+        if response.status_code != 302:
+            raise RuntimeError(f'/add_score: HTTP {response.status_code}')
+
+    team = lambda: rng.choice(team_ids)
+    player = lambda: rng.choice(player_ids)
+    suite = {
+        'http index': get('/'),
+        'http team_dashboard': get(lambda: f'/team/{team()}'),
+        'http player_dashboard': get(lambda: f'/player/{player()}'),
+        'http add_score form': get('/add_score'),
+        'http leaderboard': get('/leaderboard'),
+        'model Team.get_statistics': model(Team.get_statistics, team),
+        'model Player.get_stats_by_team': model(Player.get_stats_by_team, team),
+        'model Player.get_batting_stats': model(Player.get_batting_stats, player),
+        'model Player.get_bowling_stats': model(Player.get_bowling_stats, player),
+        'model Match.get_page': model(Match.get_page, lambda: None, lambda: 20),
+        'model Leaderboard.get runs': model(Leaderboard.get, lambda: 'runs'),
+        'model Innings.get_by_id': model(Innings.get_by_id, lambda: rng.randint(1, len(match_rows) * 2)),
+    }
+    if writes:
+        suite['http add_score post'] = add_score
+    return suite
+
+def run(iterations, seed=42, cold=False, writes=True, only=None):
+    if not metrics.ENABLED:
+        raise SystemExit('queries are counted by the SQL metrics; unset CRICKET_METRICS=0')
+    rng = random.Random(seed)
+    counter = QueryCounter()
+    suite = scenarios(rng, writes)
+    results = {}
+    for name, call in suite.items():
+        if only and not any(part in name for part in only):
+            continue
+        for _ in range(min(5, iterations)):
+            call()
+        results[name] = _measure(call, iterations, counter, cold)
+        print(f'{name:34} p50 {results[name]["p50_ms"]:9.3f} ms  p95 {results[name]["p95_ms"]:9.3f} ms  '
+              f'p99 {results[name]["p99_ms"]:9.3f} ms  {results[name]["queries_per_call"]:6.2f} q  '
+              f'{results[name]["throughput_per_s"]:9.1f}/s', file=sys.stderr)
+    conn = database.get_db_connection()
+    return {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'database': database.DATABASE,
+            'rows': {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                     for table in ('teams', 'players', 'matches', 'innings', 'batting_scores', 'bowling_figures')},
+            'iterations': iterations,
+            'seed': seed,
+            'cold': cold,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+        },
+        'results': results,
+    }
+
+def compare(baseline, current, threshold=0.10):
+    # Prints the change per scenario; returns the scenarios whose p50 or p95
+    # latency, or query count, grew by more than the threshold
+    regressions = []
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f'{name:34} new')
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms', 'queries_per_call'):
+            change = (result[key] - before[key]) / before[key] if before[key] else 0.0
+            changes.append(f'{key} {before[key]} -> {result[key]} ({change:+.0%})')
+            if change > threshold:
+                regressions.append(name)
+        print(f'{name:34} ' + ', '.join(changes))
+    return sorted(set(regressions))
+
+def _load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate synthetic data and benchmark the dashboard')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = commands.add_parser('generate', help='fill a database with synthetic matches')
+    generate_parser.add_argument('--db', required=True, help='database file to fill')
+    generate_parser.add_argument('--scale', type=int, default=100000,
+                                 help='batting and bowling rows to generate (10k to 10M)')
+    generate_parser.add_argument('--seed', type=int, default=42)
+
+    run_parser = commands.add_parser('run', help='benchmark routes and model methods')
+    run_parser.add_argument('--db', required=True, help='database file to benchmark against')
+    run_parser.add_argument('--iterations', type=int, default=200)
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--cold', action='store_true', help='clear the stats and chart caches before each call')
+    run_parser.add_argument('--no-writes', action='store_true', help='skip the add_score POST scenario')
+    run_parser.add_argument('--only', nargs='+', help='run scenarios whose name contains any of these')
+    run_parser.add_argument('--out', help='write results as JSON')
+    run_parser.add_argument('--compare', help='baseline results JSON to compare against')
+    run_parser.add_argument('--threshold', type=float, default=0.10, help='relative slowdown counted as a regression')
+
+    compare_parser = commands.add_parser('compare', help='compare two results files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.10)
+
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        regressions = compare(_load(args.baseline), _load(args.current), args.threshold)
+    else:
+        database.configure(args.db)
+        database.init_db()
+        if args.command == 'generate':
+            matches, rows = generate(args.scale, args.seed)
+            print(f'Generated {matches} matches, {rows} rows')
+            return 0
+        results = run(args.iterations, args.seed, args.cold, not args.no_writes, args.only)
+        if args.out:
+            with open(args.out, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+        regressions = compare(_load(args.compare), results, args.threshold) if args.compare else []
+    if regressions:
+        print('Regressions: ' + ', '.join(regressions))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
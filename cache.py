@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+_MISSING = object()
+
+class LRUCache:
+    # Thread-safe LRU cache with a per-entry TTL. Entries can carry tags such as
+    # ('team', 3) or ('player', 17) so writes can drop exactly what they affect.
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = {}
+        # Bumped by invalidate()/clear() so a read that started before a write
+        # cannot store its result after the write dropped the entry
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, tags = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self, tags=()):
+        # Token for set(): taken before computing a value, it makes set() a no-op
+        # if any of the tags was invalidated in the meantime
+        with self._lock:
+            return self._epoch, tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def set(self, key, value, tags=(), generation=None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if generation is not None and generation != (
+                    self._epoch, tuple(self._generations.get(tag, 0) for tag in tags)):
+                return
+            if key in self._entries:
+                self._remove(key)
+            tags = frozenset(tags)
+            self._entries[key] = (value, expires_at, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._epoch += 1
+
+    def info(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+def cached(cache, tags, bypass=None, version=None):
+    # Read-through caching for a model read; tags(*args, **kwargs) names the
+    # team/player ids the result depends on so the write paths can invalidate it.
+    # version(tags), when given, says what state those ids are at and is part of
+    # the key, so changes the write paths never saw (another process's writes)
+    # still miss. While bypass() is true the read goes straight to func and the
+    # cache is neither consulted nor filled
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if bypass is not None and bypass():
+                return func(*args, **kwargs)
+            entry_tags = tags(*args, **kwargs)
+            key = (func.__qualname__,) + args + tuple(sorted(kwargs.items()))
+            if version is not None:
+                key += (version(entry_tags),)
+            value = cache.get(key, _MISSING)
+            if value is _MISSING:
+                generation = cache.generation(entry_tags)
+                value = func(*args, **kwargs)
+                cache.set(key, value, entry_tags, generation)
+            return value
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+stats_cache = LRUCache(
+    maxsize=int(os.environ.get('CRICKET_CACHE_SIZE', 4096)),
+    ttl=float(os.environ.get('CRICKET_CACHE_TTL', 300)),
+)
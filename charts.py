@@ -0,0 +1,95 @@
+import json
+import os
+
+from cache import LRUCache, cached
+
+# Plotly is imported on the first chart build rather than here, so workers that
+# only serve JSON never pay for loading it
+
+# Serialized figure JSON keyed by the data it was built from. Entries never go
+# stale (new stats mean a new key), so there is no TTL, only the size bound.
+chart_cache = LRUCache(maxsize=int(os.environ.get('CRICKET_CHART_CACHE_SIZE', 1024)), ttl=0)
+
+def _no_tags(*args, **kwargs):
+    return ()
+
+def _to_json(figure):
+    import plotly.utils
+    return json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder)
+
+@cached(chart_cache, _no_tags)
+def player_bar_chart(title, yaxis_title, player_names, values, color):
+    import plotly.graph_objs as go
+    chart = go.Figure(data=[
+        go.Bar(x=list(player_names), y=list(values), marker_color=color)
+    ])
+    chart.update_layout(title=title, xaxis_title='Player', yaxis_title=yaxis_title)
+    return _to_json(chart)
+
+@cached(chart_cache, _no_tags)
+def runs_distribution_pie(total_runs, total_fours, total_sixes):
+    import plotly.graph_objs as go
+    if not total_runs:
+        return None
+    boundary_runs = ((total_fours or 0) * 4) + ((total_sixes or 0) * 6)
+    batting_pie = go.Figure(data=[go.Pie(
+        labels=['Boundaries (4s & 6s)', 'Singles & Doubles'],
+        values=[boundary_runs, total_runs - boundary_runs],
+        marker_colors=['#ff9999', '#66b3ff']
+    )])
+    batting_pie.update_layout(title='Runs Distribution')
+    return _to_json(batting_pie)
+
+@cached(chart_cache, _no_tags)
+def strike_rate_gauge(strike_rate):
+    import plotly.graph_objs as go
+    if not strike_rate:
+        return None
+    sr_gauge = go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=strike_rate,
+        domain={'x': [0, 1], 'y': [0, 1]},
+        title={'text': "Strike Rate"},
+        gauge={'axis': {'range': [None, 200]},
+               'bar': {'color': "darkblue"},
+               'steps': [
+                   {'range': [0, 80], 'color': "lightgray"},
+                   {'range': [80, 120], 'color': "gray"},
+                   {'range': [120, 200], 'color': "lightgreen"}],
+               'threshold': {'line': {'color': "red", 'width': 4}, 'thickness': 0.75, 'value': 150}}))
+    return _to_json(sr_gauge)
+
+@cached(chart_cache, _no_tags)
+def form_chart(innings_runs, rolling_averages, window):
+    import plotly.graph_objs as go
+    if not innings_runs:
+        return None
+    innings = list(range(1, len(innings_runs) + 1))
+    chart = go.Figure(data=[
+        go.Bar(x=innings, y=list(innings_runs), name='Runs', marker_color='lightblue'),
+        go.Scatter(x=innings, y=list(rolling_averages), name=f'{window}-innings average',
+                   mode='lines+markers', line={'color': 'darkblue'}),
+    ])
+    chart.update_layout(title='Form', xaxis_title='Innings', yaxis_title='Runs')
+    return _to_json(chart)
+
+@cached(chart_cache, _no_tags)
+def position_strike_rate_chart(positions, strike_rates):
+    import plotly.graph_objs as go
+    if not positions:
+        return None
+    chart = go.Figure(data=[
+        go.Bar(x=[str(p) for p in positions], y=list(strike_rates), marker_color='lightgreen')
+    ])
+    chart.update_layout(title='Strike Rate by Batting Position', xaxis_title='Position',
+                        yaxis_title='Strike Rate')
+    return _to_json(chart)
+
+@cached(chart_cache, _no_tags)
+def dismissal_pie(labels, counts):
+    import plotly.graph_objs as go
+    if not labels:
+        return None
+    chart = go.Figure(data=[go.Pie(labels=list(labels), values=list(counts))])
+    chart.update_layout(title='Dismissals')
+    return _to_json(chart)
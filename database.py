@@ -1,13 +1,631 @@
+import os
 import sqlite3
+import threading
 from datetime import datetime
 
-def get_db_connection():
-    conn = sqlite3.connect('cricket.db')
+DATABASE = os.environ.get('CRICKET_DB', 'cricket.db')
+POOL_SIZE = int(os.environ.get('CRICKET_DB_POOL_SIZE', 8))
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+)
+
+_local = threading.local()
+_pool = []
+_pool_lock = threading.Lock()
+_connection_factory = sqlite3.Connection
+_on_checkout = None
+_initialized = set()
+_init_lock = threading.Lock()
+_inherited = []
+
+def configure(database=None, pool_size=None):
+    global DATABASE, POOL_SIZE
+    close_all_connections()
+    if database is not None:
+        DATABASE = database
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+
+def set_connection_factory(factory, on_checkout=None):
+    # Connections opened from now on are created by factory (a sqlite3.Connection
+    # subclass); on_checkout(conn) runs whenever a thread takes a connection
+    global _connection_factory, _on_checkout
+    _connection_factory = factory
+    _on_checkout = on_checkout
+    close_all_connections()
+
+def _connect():
+    conn = sqlite3.connect(DATABASE, check_same_thread=False, factory=_connection_factory)
     conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-def init_db():
+def connect_read_only(path):
+    # A read-only connection to a copy of the database (see snapshot.py), made
+    # by the same factory as the pool's connections
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False,
+                           factory=_connection_factory)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def get_db_connection():
+    # One connection per thread, checked out of a shared pool on first use and
+    # kept until release_db_connection() hands it back (end of each request)
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        return conn
+    with _pool_lock:
+        while _pool:
+            database, conn = _pool.pop()
+            if database == DATABASE:
+                break
+            conn.close()
+            conn = None
+    if conn is None:
+        conn = _connect()
+    if _on_checkout is not None:
+        _on_checkout(conn)
+    _local.conn = conn
+    _local.database = DATABASE
+    return conn
+
+def release_db_connection(exception=None):
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    _local.conn = None
+    if conn.in_transaction:
+        conn.rollback()
+    with _pool_lock:
+        if _local.database == DATABASE and len(_pool) < POOL_SIZE:
+            _pool.append((_local.database, conn))
+            return
+    conn.close()
+
+def close_all_connections():
+    release_db_connection()
+    with _pool_lock:
+        while _pool:
+            _pool.pop()[1].close()
+
+def _reset_after_fork():
+    # A forked worker must never use (or close) connections opened by its
+    # parent; they are parked unused and the child starts with an empty pool
+    global _local, _pool_lock
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _inherited.append(conn)
+    _inherited.extend(conn for _, conn in _pool)
+    _pool.clear()
+    _local = threading.local()
+    _pool_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+# Career totals as they follow from the raw score rows; used to backfill and
+# to check/rebuild the incrementally maintained player_*_career tables
+BATTING_CAREER_SELECT = '''
+    SELECT 
+        player_id,
+        COUNT(*) as innings,
+        SUM(runs_scored) as total_runs,
+        SUM(balls_faced) as total_balls,
+        MAX(runs_scored) as highest_score,
+        SUM(fours) as total_fours,
+        SUM(sixes) as total_sixes,
+        SUM(CASE WHEN is_out = 0 THEN 1 ELSE 0 END) as not_outs
+    FROM batting_scores
+    GROUP BY player_id
+'''
+
+BOWLING_CAREER_SELECT = '''
+    SELECT 
+        bowler_id as player_id,
+        COUNT(*) as innings,
+        SUM(overs) as total_overs,
+        SUM(runs_conceded) as runs_conceded,
+        SUM(wickets) as total_wickets,
+        MAX(wickets) as best_bowling
+    FROM bowling_figures
+    GROUP BY bowler_id
+'''
+
+# Monthly rollups of the same totals per player or team. A season is the twelve
+# months of a calendar year; a date range reads its whole months from these
+# tables and only its partial edge months from the score rows.
+ROLLUPS = {
+    'batting': {
+        'table': 'player_batting_rollup',
+        'key': 'player_id',
+        'source_key': 'bs.player_id',
+        'source': '''matches m
+            JOIN innings i ON i.match_id = m.id
+            JOIN batting_scores bs ON bs.innings_id = i.id''',
+        'columns': (
+            ('innings', 'SUM', 'COUNT(*)'),
+            ('total_runs', 'SUM', 'SUM(bs.runs_scored)'),
+            ('total_balls', 'SUM', 'SUM(bs.balls_faced)'),
+            ('highest_score', 'MAX', 'MAX(bs.runs_scored)'),
+            ('total_fours', 'SUM', 'SUM(bs.fours)'),
+            ('total_sixes', 'SUM', 'SUM(bs.sixes)'),
+            ('not_outs', 'SUM', 'SUM(CASE WHEN bs.is_out = 0 THEN 1 ELSE 0 END)'),
+        ),
+    },
+    'bowling': {
+        'table': 'player_bowling_rollup',
+        'key': 'player_id',
+        'source_key': 'bf.bowler_id',
+        'source': '''matches m
+            JOIN innings i ON i.match_id = m.id
+            JOIN bowling_figures bf ON bf.innings_id = i.id''',
+        'columns': (
+            ('innings', 'SUM', 'COUNT(*)'),
+            ('total_overs', 'SUM', 'SUM(bf.overs)'),
+            ('runs_conceded', 'SUM', 'SUM(bf.runs_conceded)'),
+            ('total_wickets', 'SUM', 'SUM(bf.wickets)'),
+            ('best_bowling', 'MAX', 'MAX(bf.wickets)'),
+        ),
+    },
+    'team': {
+        'table': 'team_rollup',
+        'key': 'team_id',
+        'source_key': 'i.batting_team_id',
+        'source': '''matches m
+            JOIN innings i ON i.match_id = m.id''',
+        'columns': (
+            ('matches_played', 'SUM', 'COUNT(DISTINCT i.match_id)'),
+            ('innings', 'SUM', 'COUNT(*)'),
+            ('total_runs', 'SUM', 'SUM(i.total_runs)'),
+            ('total_wickets', 'SUM', 'SUM(i.total_wickets)'),
+        ),
+    },
+}
+
+def rollup_select(kind, where='1'):
+    # Per-month totals straight from the score rows
+    rollup = ROLLUPS[kind]
+    columns = ',\n        '.join(f'{expression} as {name}' for name, _, expression in rollup['columns'])
+    return f'''
+    SELECT 
+        {rollup['source_key']} as {rollup['key']},
+        substr(m.match_date, 1, 7) as month,
+        {columns}
+    FROM {rollup['source']}
+    WHERE {where}
+    GROUP BY 1, 2
+'''
+
+def bump_versions(*scopes):
+    # SQL that bumps the 'global' data version plus the given scope expressions
+    values = ', '.join(f'({scope}, 1, CURRENT_TIMESTAMP)' for scope in ("'global'",) + scopes)
+    return f'''INSERT INTO data_versions (scope, version, updated_at) VALUES {values}
+                  ON CONFLICT (scope) DO UPDATE SET
+                      version = version + 1,
+                      updated_at = excluded.updated_at;'''
+
+# Schema migrations, applied in order on top of the base tables created by
+# init_db(). PRAGMA user_version records how many have been applied, so
+# existing database files are upgraded in place.
+MIGRATIONS = [
+    # 1: indexes for the player, team and innings stats lookups
+    [
+        '''CREATE INDEX IF NOT EXISTS idx_batting_scores_player
+           ON batting_scores (player_id, runs_scored, balls_faced, fours, sixes, is_out)''',
+        '''CREATE INDEX IF NOT EXISTS idx_batting_scores_innings
+           ON batting_scores (innings_id, batting_position)''',
+        '''CREATE INDEX IF NOT EXISTS idx_bowling_figures_bowler
+           ON bowling_figures (bowler_id, overs, runs_conceded, wickets)''',
+        '''CREATE INDEX IF NOT EXISTS idx_bowling_figures_innings
+           ON bowling_figures (innings_id)''',
+        '''CREATE INDEX IF NOT EXISTS idx_innings_batting_team
+           ON innings (batting_team_id, match_id, total_runs, total_wickets)''',
+        '''CREATE INDEX IF NOT EXISTS idx_partnerships_innings
+           ON partnerships (innings_id, wicket_number)''',
+        '''CREATE INDEX IF NOT EXISTS idx_players_team
+           ON players (team_id, name)''',
+    ],
+    # 2: career totals per player, kept current by triggers on every insert
+    [
+        '''CREATE TABLE IF NOT EXISTS player_batting_career (
+            player_id INTEGER PRIMARY KEY,
+            innings INTEGER NOT NULL DEFAULT 0,
+            total_runs INTEGER,
+            total_balls INTEGER,
+            highest_score INTEGER,
+            total_fours INTEGER,
+            total_sixes INTEGER,
+            not_outs INTEGER,
+            FOREIGN KEY (player_id) REFERENCES players (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS player_bowling_career (
+            player_id INTEGER PRIMARY KEY,
+            innings INTEGER NOT NULL DEFAULT 0,
+            total_overs REAL,
+            runs_conceded INTEGER,
+            total_wickets INTEGER,
+            best_bowling INTEGER,
+            FOREIGN KEY (player_id) REFERENCES players (id)
+        )''',
+        'INSERT OR REPLACE INTO player_batting_career ' + BATTING_CAREER_SELECT,
+        'INSERT OR REPLACE INTO player_bowling_career ' + BOWLING_CAREER_SELECT,
+        '''CREATE TRIGGER IF NOT EXISTS trg_batting_scores_career
+           AFTER INSERT ON batting_scores
+           BEGIN
+               INSERT INTO player_batting_career
+               (player_id, innings, total_runs, total_balls, highest_score,
+                total_fours, total_sixes, not_outs)
+               VALUES (NEW.player_id, 1, NEW.runs_scored, NEW.balls_faced, NEW.runs_scored,
+                       NEW.fours, NEW.sixes, CASE WHEN NEW.is_out = 0 THEN 1 ELSE 0 END)
+               ON CONFLICT (player_id) DO UPDATE SET
+                   innings = innings + 1,
+                   total_runs = total_runs + excluded.total_runs,
+                   total_balls = total_balls + excluded.total_balls,
+                   highest_score = MAX(highest_score, excluded.highest_score),
+                   total_fours = total_fours + excluded.total_fours,
+                   total_sixes = total_sixes + excluded.total_sixes,
+                   not_outs = not_outs + excluded.not_outs;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_bowling_figures_career
+           AFTER INSERT ON bowling_figures
+           BEGIN
+               INSERT INTO player_bowling_career
+               (player_id, innings, total_overs, runs_conceded, total_wickets, best_bowling)
+               VALUES (NEW.bowler_id, 1, NEW.overs, NEW.runs_conceded, NEW.wickets, NEW.wickets)
+               ON CONFLICT (player_id) DO UPDATE SET
+                   innings = innings + 1,
+                   total_overs = total_overs + excluded.total_overs,
+                   runs_conceded = runs_conceded + excluded.runs_conceded,
+                   total_wickets = total_wickets + excluded.total_wickets,
+                   best_bowling = MAX(best_bowling, excluded.best_bowling);
+           END''',
+    ],
+    # 3: keyset pagination of the home page listings
+    [
+        '''CREATE INDEX IF NOT EXISTS idx_matches_date
+           ON matches (match_date, id)''',
+    ],
+    # 4: player name search; trigram FTS for substrings, NOCASE index for short prefixes
+    [
+        '''CREATE INDEX IF NOT EXISTS idx_players_name_nocase
+           ON players (name COLLATE NOCASE)''',
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS players_fts USING fts5 (
+            name, content='players', content_rowid='id', tokenize='trigram'
+        )''',
+        "INSERT INTO players_fts (players_fts) VALUES ('rebuild')",
+        '''CREATE TRIGGER IF NOT EXISTS trg_players_fts_insert
+           AFTER INSERT ON players
+           BEGIN
+               INSERT INTO players_fts (rowid, name) VALUES (NEW.id, NEW.name);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_players_fts_delete
+           AFTER DELETE ON players
+           BEGIN
+               INSERT INTO players_fts (players_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_players_fts_update
+           AFTER UPDATE OF name ON players
+           BEGIN
+               INSERT INTO players_fts (players_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+               INSERT INTO players_fts (rowid, name) VALUES (NEW.id, NEW.name);
+           END''',
+    ],
+    # 5: data version counters for HTTP validators, bumped by triggers on every write
+    [
+        '''CREATE TABLE IF NOT EXISTS data_versions (
+            scope TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID''',
+        *[f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+              AFTER {event} ON {table}
+              BEGIN
+                  {bump_versions(*scopes)}
+              END'''
+          for table, event, scopes in (
+              ('teams', 'INSERT', ["'team:' || NEW.id"]),
+              ('players', 'INSERT', ["'team:' || NEW.team_id", "'player:' || NEW.id"]),
+              ('matches', 'INSERT', []),
+              ('innings', 'INSERT', ["'team:' || NEW.batting_team_id", "'team:' || NEW.bowling_team_id"]),
+              ('innings', 'UPDATE', ["'team:' || NEW.batting_team_id", "'team:' || NEW.bowling_team_id"]),
+              ('batting_scores', 'INSERT', ["'player:' || NEW.player_id",
+                                            "'team:' || (SELECT team_id FROM players WHERE id = NEW.player_id)"]),
+              ('bowling_figures', 'INSERT', ["'player:' || NEW.bowler_id",
+                                             "'team:' || (SELECT team_id FROM players WHERE id = NEW.bowler_id)"]),
+              ('partnerships', 'INSERT', []),
+          )],
+    ],
+    # 6: ball-by-ball deliveries; score rows are now also updated in place, so the
+    # career and version triggers learn to apply UPDATE deltas
+    [
+        '''CREATE TABLE IF NOT EXISTS deliveries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            innings_id INTEGER NOT NULL,
+            over_number INTEGER NOT NULL,
+            ball_number INTEGER NOT NULL,
+            batsman_id INTEGER NOT NULL,
+            non_striker_id INTEGER,
+            bowler_id INTEGER NOT NULL,
+            runs_batter INTEGER DEFAULT 0,
+            extras INTEGER DEFAULT 0,
+            extra_type TEXT CHECK(extra_type IN ('wide', 'noball', 'bye', 'legbye')),
+            is_wicket BOOLEAN DEFAULT 0,
+            dismissal_type TEXT,
+            player_out_id INTEGER,
+            fielder_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (innings_id) REFERENCES innings (id),
+            FOREIGN KEY (batsman_id) REFERENCES players (id),
+            FOREIGN KEY (non_striker_id) REFERENCES players (id),
+            FOREIGN KEY (bowler_id) REFERENCES players (id),
+            FOREIGN KEY (player_out_id) REFERENCES players (id),
+            FOREIGN KEY (fielder_id) REFERENCES players (id)
+        )''',
+        '''CREATE INDEX IF NOT EXISTS idx_deliveries_innings_over
+           ON deliveries (innings_id, over_number, bowler_id)''',
+        '''CREATE INDEX IF NOT EXISTS idx_batting_scores_innings_player
+           ON batting_scores (innings_id, player_id)''',
+        '''CREATE INDEX IF NOT EXISTS idx_bowling_figures_innings_bowler
+           ON bowling_figures (innings_id, bowler_id)''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_batting_scores_career_update
+           AFTER UPDATE ON batting_scores
+           BEGIN
+               UPDATE player_batting_career SET
+                   total_runs = total_runs + NEW.runs_scored - OLD.runs_scored,
+                   total_balls = total_balls + NEW.balls_faced - OLD.balls_faced,
+                   highest_score = MAX(highest_score, NEW.runs_scored),
+                   total_fours = total_fours + NEW.fours - OLD.fours,
+                   total_sixes = total_sixes + NEW.sixes - OLD.sixes,
+                   not_outs = not_outs + (CASE WHEN NEW.is_out = 0 THEN 1 ELSE 0 END)
+                                       - (CASE WHEN OLD.is_out = 0 THEN 1 ELSE 0 END)
+               WHERE player_id = NEW.player_id;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_bowling_figures_career_update
+           AFTER UPDATE ON bowling_figures
+           BEGIN
+               UPDATE player_bowling_career SET
+                   total_overs = total_overs + NEW.overs - OLD.overs,
+                   runs_conceded = runs_conceded + NEW.runs_conceded - OLD.runs_conceded,
+                   total_wickets = total_wickets + NEW.wickets - OLD.wickets,
+                   best_bowling = MAX(best_bowling, NEW.wickets)
+               WHERE player_id = NEW.bowler_id;
+           END''',
+        *[f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+              AFTER {event} ON {table}
+              BEGIN
+                  {bump_versions(*scopes)}
+              END'''
+          for table, event, scopes in (
+              ('batting_scores', 'UPDATE', ["'player:' || NEW.player_id",
+                                            "'team:' || (SELECT team_id FROM players WHERE id = NEW.player_id)"]),
+              ('bowling_figures', 'UPDATE', ["'player:' || NEW.bowler_id",
+                                             "'team:' || (SELECT team_id FROM players WHERE id = NEW.bowler_id)"]),
+              ('partnerships', 'UPDATE', []),
+          )],
+    ],
+    # 7: leaderboard rankings, read in order straight off the career tables
+    [
+        '''CREATE INDEX IF NOT EXISTS idx_batting_career_runs
+           ON player_batting_career (total_runs DESC)''',
+        '''CREATE INDEX IF NOT EXISTS idx_batting_career_average
+           ON player_batting_career ((CAST(total_runs AS REAL) / innings) DESC)''',
+        '''CREATE INDEX IF NOT EXISTS idx_batting_career_strike_rate
+           ON player_batting_career ((CAST(total_runs AS REAL) * 100 / total_balls) DESC)''',
+        '''CREATE INDEX IF NOT EXISTS idx_bowling_career_wickets
+           ON player_bowling_career (total_wickets DESC)''',
+        '''CREATE INDEX IF NOT EXISTS idx_bowling_career_economy
+           ON player_bowling_career ((CAST(runs_conceded AS REAL) * 6 / total_overs))''',
+        '''CREATE INDEX IF NOT EXISTS idx_innings_match
+           ON innings (match_id, innings_number)''',
+    ],
+    # 8: monthly rollups per player and team for season and date-range stats
+    [
+        '''CREATE TABLE IF NOT EXISTS player_batting_rollup (
+            player_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            innings INTEGER NOT NULL DEFAULT 0,
+            total_runs INTEGER,
+            total_balls INTEGER,
+            highest_score INTEGER,
+            total_fours INTEGER,
+            total_sixes INTEGER,
+            not_outs INTEGER,
+            PRIMARY KEY (player_id, month)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS player_bowling_rollup (
+            player_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            innings INTEGER NOT NULL DEFAULT 0,
+            total_overs REAL,
+            runs_conceded INTEGER,
+            total_wickets INTEGER,
+            best_bowling INTEGER,
+            PRIMARY KEY (player_id, month)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS team_rollup (
+            team_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            matches_played INTEGER NOT NULL DEFAULT 0,
+            innings INTEGER NOT NULL DEFAULT 0,
+            total_runs INTEGER,
+            total_wickets INTEGER,
+            PRIMARY KEY (team_id, month)
+        ) WITHOUT ROWID''',
+        '''CREATE INDEX IF NOT EXISTS idx_player_batting_rollup_month
+           ON player_batting_rollup (month)''',
+        '''CREATE INDEX IF NOT EXISTS idx_player_bowling_rollup_month
+           ON player_bowling_rollup (month)''',
+        'INSERT OR REPLACE INTO player_batting_rollup ' + rollup_select('batting'),
+        'INSERT OR REPLACE INTO player_bowling_rollup ' + rollup_select('bowling'),
+        'INSERT OR REPLACE INTO team_rollup ' + rollup_select('team'),
+        '''CREATE TRIGGER IF NOT EXISTS trg_batting_scores_rollup
+           AFTER INSERT ON batting_scores
+           BEGIN
+               INSERT INTO player_batting_rollup
+               (player_id, month, innings, total_runs, total_balls, highest_score,
+                total_fours, total_sixes, not_outs)
+               SELECT NEW.player_id, substr(m.match_date, 1, 7), 1, NEW.runs_scored, NEW.balls_faced,
+                      NEW.runs_scored, NEW.fours, NEW.sixes, CASE WHEN NEW.is_out = 0 THEN 1 ELSE 0 END
+               FROM innings i JOIN matches m ON m.id = i.match_id
+               WHERE i.id = NEW.innings_id
+               ON CONFLICT (player_id, month) DO UPDATE SET
+                   innings = innings + 1,
+                   total_runs = total_runs + excluded.total_runs,
+                   total_balls = total_balls + excluded.total_balls,
+                   highest_score = MAX(highest_score, excluded.highest_score),
+                   total_fours = total_fours + excluded.total_fours,
+                   total_sixes = total_sixes + excluded.total_sixes,
+                   not_outs = not_outs + excluded.not_outs;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_batting_scores_rollup_update
+           AFTER UPDATE ON batting_scores
+           BEGIN
+               UPDATE player_batting_rollup SET
+                   total_runs = total_runs + NEW.runs_scored - OLD.runs_scored,
+                   total_balls = total_balls + NEW.balls_faced - OLD.balls_faced,
+                   highest_score = MAX(highest_score, NEW.runs_scored),
+                   total_fours = total_fours + NEW.fours - OLD.fours,
+                   total_sixes = total_sixes + NEW.sixes - OLD.sixes,
+                   not_outs = not_outs + (CASE WHEN NEW.is_out = 0 THEN 1 ELSE 0 END)
+                                       - (CASE WHEN OLD.is_out = 0 THEN 1 ELSE 0 END)
+               WHERE player_id = NEW.player_id
+                 AND month = (SELECT substr(m.match_date, 1, 7)
+                              FROM innings i JOIN matches m ON m.id = i.match_id
+                              WHERE i.id = NEW.innings_id);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_bowling_figures_rollup
+           AFTER INSERT ON bowling_figures
+           BEGIN
+               INSERT INTO player_bowling_rollup
+               (player_id, month, innings, total_overs, runs_conceded, total_wickets, best_bowling)
+               SELECT NEW.bowler_id, substr(m.match_date, 1, 7), 1, NEW.overs, NEW.runs_conceded,
+                      NEW.wickets, NEW.wickets
+               FROM innings i JOIN matches m ON m.id = i.match_id
+               WHERE i.id = NEW.innings_id
+               ON CONFLICT (player_id, month) DO UPDATE SET
+                   innings = innings + 1,
+                   total_overs = total_overs + excluded.total_overs,
+                   runs_conceded = runs_conceded + excluded.runs_conceded,
+                   total_wickets = total_wickets + excluded.total_wickets,
+                   best_bowling = MAX(best_bowling, excluded.best_bowling);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_bowling_figures_rollup_update
+           AFTER UPDATE ON bowling_figures
+           BEGIN
+               UPDATE player_bowling_rollup SET
+                   total_overs = total_overs + NEW.overs - OLD.overs,
+                   runs_conceded = runs_conceded + NEW.runs_conceded - OLD.runs_conceded,
+                   total_wickets = total_wickets + NEW.wickets - OLD.wickets,
+                   best_bowling = MAX(best_bowling, NEW.wickets)
+               WHERE player_id = NEW.bowler_id
+                 AND month = (SELECT substr(m.match_date, 1, 7)
+                              FROM innings i JOIN matches m ON m.id = i.match_id
+                              WHERE i.id = NEW.innings_id);
+           END''',
+        # A team's first innings of a match counts the match
+        '''CREATE TRIGGER IF NOT EXISTS trg_innings_rollup
+           AFTER INSERT ON innings
+           BEGIN
+               INSERT INTO team_rollup (team_id, month, matches_played, innings, total_runs, total_wickets)
+               SELECT NEW.batting_team_id, substr(m.match_date, 1, 7),
+                      NOT EXISTS (SELECT 1 FROM innings
+                                  WHERE match_id = NEW.match_id AND batting_team_id = NEW.batting_team_id
+                                    AND id <> NEW.id),
+                      1, NEW.total_runs, NEW.total_wickets
+               FROM matches m
+               WHERE m.id = NEW.match_id
+               ON CONFLICT (team_id, month) DO UPDATE SET
+                   matches_played = matches_played + excluded.matches_played,
+                   innings = innings + 1,
+                   total_runs = total_runs + excluded.total_runs,
+                   total_wickets = total_wickets + excluded.total_wickets;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_innings_rollup_update
+           AFTER UPDATE OF total_runs, total_wickets ON innings
+           BEGIN
+               UPDATE team_rollup SET
+                   total_runs = total_runs + NEW.total_runs - OLD.total_runs,
+                   total_wickets = total_wickets + NEW.total_wickets - OLD.total_wickets
+               WHERE team_id = NEW.batting_team_id
+                 AND month = (SELECT substr(match_date, 1, 7) FROM matches WHERE id = NEW.match_id);
+           END''',
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return False
+    with conn:
+        conn.execute('BEGIN')
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {number}')
+    conn.execute('ANALYZE')
+    return True
+
+def rebuild_career_stats(check_only=False):
+    # Recompute the career and rollup tables from the score rows and report
+    # how many players (or teams) disagree; unless check_only, replace them
     conn = get_db_connection()
+    mismatches = {}
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        for table, select, key, columns in (
+            ('player_batting_career', BATTING_CAREER_SELECT, 'player_id',
+             'player_id, innings, total_runs, total_balls, highest_score, '
+             'total_fours, total_sixes, not_outs'),
+            ('player_bowling_career', BOWLING_CAREER_SELECT, 'player_id',
+             'player_id, innings, ROUND(total_overs, 4), runs_conceded, '
+             'total_wickets, best_bowling'),
+            *[(rollup['table'], rollup_select(kind), rollup['key'],
+               ', '.join([rollup['key'], 'month', *[f'ROUND({name}, 4)' if name == 'total_overs' else name
+                                                    for name, _, _ in rollup['columns']]]))
+              for kind, rollup in ROLLUPS.items()],
+        ):
+            mismatches[table] = conn.execute(f'''
+                SELECT COUNT(DISTINCT {key}) FROM (
+                    SELECT * FROM (
+                        SELECT {columns} FROM ({select})
+                        EXCEPT SELECT {columns} FROM {table}
+                    )
+                    UNION ALL
+                    SELECT * FROM (
+                        SELECT {columns} FROM {table}
+                        EXCEPT SELECT {columns} FROM ({select})
+                    )
+                )
+            ''').fetchone()[0]
+            if mismatches[table] and not check_only:
+                conn.execute(f'DELETE FROM {table}')
+                conn.execute(f'INSERT INTO {table} {select}')
+    return mismatches
+
+def init_db():
+    # Runs once per database file per process; a schema already at
+    # SCHEMA_VERSION costs a single PRAGMA read
+    with _init_lock:
+        path = os.path.abspath(DATABASE)
+        if path in _initialized:
+            return
+        conn = get_db_connection()
+        if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+            _create_schema(conn)
+        _initialized.add(path)
+        # Not pooled: a server preloading the app forks after this
+        close_all_connections()
+
+def _create_schema(conn):
     cursor = conn.cursor()
     
     # Teams table
@@ -121,8 +739,23 @@ def init_db():
     ''')
     
     conn.commit()
-    conn.close()
+    
+    migrate(conn)
 
 if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Cricket dashboard database tools')
+    parser.add_argument('command', nargs='?', default='init', choices=['init', 'rebuild-career'])
+    parser.add_argument('--check', action='store_true',
+                        help='only report career and rollup stats that disagree with the score rows')
+    args = parser.parse_args()
+    
     init_db()
-    print("Database initialized successfully!")
+    if args.command == 'rebuild-career':
+        for table, count in rebuild_career_stats(check_only=args.check).items():
+            action = 'out of date' if args.check else 'repaired'
+            noun = 'team(s)' if table == 'team_rollup' else 'player(s)'
+            print(f"{table}: {count} {noun} {action}")
+    else:
+        print("Database initialized successfully!")
@@ -0,0 +1,371 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, islice
+
+import database
+
+# Bulk importer for historical scorecards.
+#
+# CSV files hold one row per batting or bowling line, with the match and innings
+# repeated on every row and the rows of a match kept together:
+#   match_date, venue, team1, team2, innings_number, batting_team, bowling_team,
+#   record (batting|bowling), player, runs, balls, fours, sixes, is_out,
+#   dismissal_type, bowler, fielder, batting_position, overs, maidens,
+#   runs_conceded, wickets
+# JSON files are Cricsheet-style ball-by-ball matches, aggregated into scorecards.
+#
+# Files are parsed in parallel by a process pool, large CSV files in byte
+# ranges of about CHUNK_BYTES (each CSV row must sit on one line). Only a
+# bounded window of parts is in flight at a time, so parsed matches cannot pile
+# up when writing is slower than parsing. The parent resolves team and player
+# names to ids through in-memory maps and writes each batch of matches with
+# executemany in one transaction.
+
+CHUNK_BYTES = 8 * 1024 * 1024
+
+NON_BOWLER_DISMISSALS = {'run out', 'retired hurt', 'retired out', 'obstructing the field'}
+
+def _int(value):
+    return int(value) if value not in (None, '') else 0
+
+def _csv_innings(rows):
+    rows = list(rows)
+    first = rows[0]
+    innings = {
+        'innings_number': _int(first['innings_number']),
+        'batting_team': first['batting_team'],
+        'bowling_team': first['bowling_team'],
+        'batting': [],
+        'bowling': [],
+        'totals': None,
+    }
+    for row in rows:
+        if row['record'] == 'batting':
+            is_out = row['is_out'].strip().lower() in ('1', 'yes', 'true', 'y')
+            innings['batting'].append((
+                row['player'], _int(row['runs']), _int(row['balls']), _int(row['fours']),
+                _int(row['sixes']), is_out, row.get('dismissal_type') or None,
+                row.get('bowler') or None, row.get('fielder') or None,
+                _int(row.get('batting_position')) or len(innings['batting']) + 1,
+            ))
+        elif row['record'] == 'bowling':
+            innings['bowling'].append((
+                row['player'], float(row['overs'] or 0), _int(row['maidens']),
+                _int(row['runs_conceded']), _int(row['wickets']),
+            ))
+    return innings
+
+def _match_key(row):
+    return row['match_date'], row['venue'], row['team1'], row['team2']
+
+def _line_before(f, position):
+    # The complete line ending just before position (which starts a line)
+    block_start = max(0, position - 65536)
+    f.seek(block_start)
+    block = f.read(position - block_start)
+    return block[block.rfind(b'\n', 0, len(block) - 1) + 1:].decode('utf-8')
+
+def parse_csv(path, start=0, end=None):
+    # Matches whose first row starts in the byte range [start, end); start and
+    # end fall on line starts. A match running past end is read to its last row,
+    # and the tail of one begun before start is left to the previous range.
+    with open(path, 'rb') as f:
+        header = next(csv.reader([f.readline().decode('utf-8-sig')]))
+        previous_key = None
+        if start > 0:
+            previous_key = _match_key(dict(zip(header, next(csv.reader([_line_before(f, start)])))))
+            f.seek(start)
+        position = [f.tell(), f.tell()]
+
+        def lines():
+            # position[0] is where the line last handed to the CSV reader starts
+            for line in iter(f.readline, b''):
+                position[0] = position[1]
+                position[1] += len(line)
+                yield line.decode('utf-8')
+
+        groups = groupby(csv.DictReader(lines(), fieldnames=header), key=_match_key)
+        for number, ((match_date, venue, team1, team2), rows) in enumerate(groups):
+            if end is not None and position[0] >= end:
+                break
+            if number == 0 and (match_date, venue, team1, team2) == previous_key:
+                continue
+            yield {
+                'match_date': match_date,
+                'venue': venue or None,
+                'team1': team1,
+                'team2': team2,
+                'innings': [_csv_innings(innings_rows) for _, innings_rows in
+                            groupby(rows, key=lambda row: row['innings_number'])],
+            }
+
+def _cricsheet_innings(number, data, teams):
+    batting_team = data['team']
+    bowling_team = next((team for team in teams if team != batting_team), batting_team)
+    batters, bowlers = {}, {}
+    totals = {'runs': 0, 'wickets': 0, 'balls': 0}
+    for over in data.get('overs', []):
+        over_runs = {}
+        for ball in over.get('deliveries', []):
+            extras = ball.get('extras', {})
+            runs = ball['runs']
+            legal = 'wides' not in extras and 'noballs' not in extras
+            charged = runs['batter'] + extras.get('wides', 0) + extras.get('noballs', 0)
+
+            batter = batters.setdefault(ball['batter'], [0, 0, 0, 0, False, None, None, None, len(batters) + 1])
+            batters.setdefault(ball['non_striker'], [0, 0, 0, 0, False, None, None, None, len(batters) + 1])
+            batter[0] += runs['batter']
+            batter[1] += 'wides' not in extras
+            batter[2] += runs['batter'] == 4
+            batter[3] += runs['batter'] == 6
+
+            bowler = bowlers.setdefault(ball['bowler'], [0, 0, 0, 0])
+            bowler[0] += legal
+            bowler[2] += charged
+            over_runs[ball['bowler']] = over_runs.get(ball['bowler'], 0) + charged
+
+            for wicket in ball.get('wickets', []):
+                kind = wicket.get('kind')
+                out = batters.setdefault(wicket['player_out'], [0, 0, 0, 0, False, None, None, None, len(batters) + 1])
+                fielders = wicket.get('fielders') or [{}]
+                credited = kind not in NON_BOWLER_DISMISSALS
+                out[4:8] = [True, kind, ball['bowler'] if credited else None, fielders[0].get('name')]
+                bowler[3] += credited
+                totals['wickets'] += 1
+
+            totals['runs'] += runs['total']
+            totals['balls'] += legal
+        for name, conceded in over_runs.items():
+            if conceded == 0 and bowlers[name][0] % 6 == 0:
+                bowlers[name][1] += 1
+
+    return {
+        'innings_number': number,
+        'batting_team': batting_team,
+        'bowling_team': bowling_team,
+        'batting': [(name, *figures) for name, figures in batters.items()],
+        'bowling': [(name, balls // 6 + (balls % 6) / 10, maidens, conceded, wickets)
+                    for name, (balls, maidens, conceded, wickets) in bowlers.items()],
+        'totals': totals,
+    }
+
+def parse_cricsheet(path, start=0, end=None):
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    info = data['info']
+    teams = info['teams']
+    yield {
+        'match_date': info['dates'][0],
+        'venue': info.get('venue'),
+        'team1': teams[0],
+        'team2': teams[1],
+        'innings': [_cricsheet_innings(number, innings, teams)
+                    for number, innings in enumerate(data.get('innings', []), start=1)],
+    }
+
+def iter_matches(path, start=0, end=None):
+    parser = parse_csv if path.endswith('.csv') else parse_cricsheet
+    return parser(path, start, end)
+
+def parse_part(part):
+    # Runs in a worker process; returns plain data so it pickles cheaply
+    return part[0], list(iter_matches(*part))
+
+def split_file(path, chunk_bytes=CHUNK_BYTES):
+    # (path, start, end) parts of a file; CSV files larger than chunk_bytes are
+    # cut at the line starts following each multiple of chunk_bytes
+    size = os.path.getsize(path)
+    if not path.endswith('.csv') or size <= chunk_bytes:
+        yield path, 0, None
+        return
+    with open(path, 'rb') as f:
+        start = 0
+        while True:
+            f.seek(start + chunk_bytes)
+            f.readline()
+            end = f.tell()
+            if end >= size:
+                yield path, start, None
+                return
+            yield path, start, end
+            start = end
+
+def parse_parts(parts, jobs):
+    # (path, matches) per part in order, with at most 2 * jobs parts parsed
+    # ahead of the consumer; with one job, matches stream from the file as read
+    if jobs <= 1:
+        for part in parts:
+            yield part[0], iter_matches(*part)
+        return
+    parts = iter(parts)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        window = deque(pool.submit(parse_part, part) for part in islice(parts, 2 * jobs))
+        while window:
+            result = window.popleft().result()
+            for part in islice(parts, 1):
+                window.append(pool.submit(parse_part, part))
+            yield result
+
+def find_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.endswith(('.csv', '.json')):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+class Loader:
+    def __init__(self, conn):
+        self.conn = conn
+        self.teams = {row['name']: row['id'] for row in conn.execute('SELECT id, name FROM teams')}
+        self.players = {(row['name'], row['team_id']): row['id']
+                        for row in conn.execute('SELECT id, name, team_id FROM players')}
+        self.pending = []
+        self.pending_rows = 0
+        self.matches = 0
+        self.rows = 0
+
+    def add(self, match):
+        self.pending.append(match)
+        self.pending_rows += sum(len(i['batting']) + len(i['bowling']) for i in match['innings'])
+
+    def flush(self):
+        if not self.pending:
+            return
+        conn = self.conn
+        with conn:
+            # Holding the write lock, ids can be assigned here instead of read back row by row
+            conn.execute('BEGIN IMMEDIATE')
+            next_id = {table: conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+                       for table in ('teams', 'players', 'matches', 'innings')}
+            # Names not seen yet may have been added by the app since the maps
+            # were loaded, so they are looked up before being created. They join
+            # the maps only once this transaction commits.
+            teams, players, new_teams, new_players = {}, {}, [], []
+
+            def team_id(name):
+                found = self.teams.get(name) or teams.get(name)
+                if found is None:
+                    row = conn.execute('SELECT id FROM teams WHERE name = ?', (name,)).fetchone()
+                    if row is None:
+                        next_id['teams'] += 1
+                        row = (next_id['teams'],)
+                        new_teams.append((row[0], name))
+                    found = teams[name] = row[0]
+                return found
+
+            def player_id(name, team):
+                if not name:
+                    return None
+                key = (name, team)
+                found = self.players.get(key) or players.get(key)
+                if found is None:
+                    row = conn.execute('SELECT id FROM players WHERE name = ? AND team_id = ?', key).fetchone()
+                    if row is None:
+                        next_id['players'] += 1
+                        row = (next_id['players'],)
+                        new_players.append((row[0], name, team))
+                    found = players[key] = row[0]
+                return found
+
+            matches, innings_rows, batting_rows, bowling_rows = [], [], [], []
+            for match in self.pending:
+                next_id['matches'] += 1
+                match_id = next_id['matches']
+                matches.append((match_id, team_id(match['team1']), team_id(match['team2']),
+                                match['match_date'], match['venue']))
+                for innings in match['innings']:
+                    next_id['innings'] += 1
+                    innings_id = next_id['innings']
+                    batting_team = team_id(innings['batting_team'])
+                    bowling_team = team_id(innings['bowling_team'])
+                    totals = innings['totals'] or {
+                        'runs': sum(row[1] for row in innings['batting']),
+                        'wickets': sum(row[5] for row in innings['batting']),
+                        'balls': sum(row[2] for row in innings['batting']),
+                    }
+                    innings_rows.append((innings_id, match_id, batting_team, bowling_team,
+                                         innings['innings_number'], totals['runs'],
+                                         totals['wickets'], totals['balls']))
+                    for name, runs, balls, fours, sixes, is_out, dismissal, bowler, fielder, position in innings['batting']:
+                        batting_rows.append((innings_id, player_id(name, batting_team), runs, balls, fours,
+                                             sixes, is_out, dismissal, player_id(bowler, bowling_team),
+                                             player_id(fielder, bowling_team), 0, position))
+                    for name, overs, maidens, conceded, wickets in innings['bowling']:
+                        bowling_rows.append((innings_id, player_id(name, bowling_team), overs,
+                                             maidens, conceded, wickets))
+
+            conn.executemany('INSERT INTO teams (id, name) VALUES (?, ?)', new_teams)
+            conn.executemany('INSERT INTO players (id, name, team_id) VALUES (?, ?, ?)', new_players)
+            conn.executemany('''
+                INSERT INTO matches (id, team1_id, team2_id, match_date, venue) VALUES (?, ?, ?, ?, ?)
+            ''', matches)
+            conn.executemany('''
+                INSERT INTO innings
+                (id, match_id, batting_team_id, bowling_team_id, innings_number,
+                 total_runs, total_wickets, total_balls)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', innings_rows)
+            conn.executemany('''
+                INSERT INTO batting_scores
+                (innings_id, player_id, runs_scored, balls_faced, fours, sixes,
+                 is_out, dismissal_type, bowler_id, fielder_id, partnership_runs, batting_position)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batting_rows)
+            conn.executemany('''
+                INSERT INTO bowling_figures
+                (innings_id, bowler_id, overs, maidens, runs_conceded, wickets)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', bowling_rows)
+
+        self.teams.update(teams)
+        self.players.update(players)
+        self.matches += len(matches)
+        self.rows += len(batting_rows) + len(bowling_rows)
+        self.pending = []
+        self.pending_rows = 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import historical scorecards from CSV or Cricsheet JSON')
+    parser.add_argument('paths', nargs='+', help='files or directories of .csv/.json scorecards')
+    parser.add_argument('--db', help='database file (default: CRICKET_DB or cricket.db)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='parser processes')
+    parser.add_argument('--batch-rows', type=int, default=50000,
+                        help='batting/bowling rows written per transaction')
+    parser.add_argument('--chunk-mb', type=float, default=CHUNK_BYTES / 2 ** 20,
+                        help='CSV files larger than this are parsed in parts of this size')
+    args = parser.parse_args(argv)
+
+    if args.db:
+        database.configure(args.db)
+    database.init_db()
+    loader = Loader(database.get_db_connection())
+    chunk_bytes = max(1, int(args.chunk_mb * 2 ** 20))
+    parts = [part for path in find_files(args.paths) for part in split_file(path, chunk_bytes)]
+    started = time.monotonic()
+
+    def report(parts_done):
+        elapsed = time.monotonic() - started
+        print(f'{parts_done}/{len(parts)} parts, {loader.matches} matches, {loader.rows} rows, '
+              f'{loader.rows / elapsed if elapsed else 0:,.0f} rows/s', file=sys.stderr)
+
+    for parts_done, (path, matches) in enumerate(parse_parts(parts, args.jobs), start=1):
+        for match in matches:
+            loader.add(match)
+            if loader.pending_rows >= args.batch_rows:
+                loader.flush()
+                report(parts_done)
+    loader.flush()
+    report(len(parts))
+    database.get_db_connection().execute('ANALYZE')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+from collections import deque
+
+class Subscription:
+    # A subscriber's bounded buffer of pending events. When a slow client lets
+    # it fill up, the backlog is dropped and replaced by a single 'resync' event
+    # so publishers never block and memory per client stays fixed.
+    def __init__(self, channels, buffer_size):
+        self.channels = channels
+        self._buffer_size = buffer_size
+        self._events = deque()
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def push(self, event):
+        with self._lock:
+            if len(self._events) >= self._buffer_size:
+                self.dropped += len(self._events)
+                self._events.clear()
+                self._events.append(('resync', {}))
+            else:
+                self._events.append(event)
+        self._ready.set()
+
+    def get(self, timeout=None):
+        # Pending events, oldest first; empty if nothing arrived within timeout
+        if not self._ready.wait(timeout):
+            return []
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+            self._ready.clear()
+        return events
+
+class Broadcaster:
+    # In-process publish/subscribe: a write publishes a delta once and it is
+    # appended to the buffer of every subscriber of the channel
+    def __init__(self, buffer_size=64):
+        self.buffer_size = buffer_size
+        self._channels = {}
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, *channels):
+        subscription = Subscription(channels, self.buffer_size)
+        with self._lock:
+            for channel in channels:
+                self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._channels[channel]
+
+    def publish(self, channels, event, data):
+        with self._lock:
+            subscribers = set()
+            for channel in channels:
+                subscribers.update(self._channels.get(channel, ()))
+            self.published += 1
+        for subscription in subscribers:
+            subscription.push((event, data))
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(set().union(*self._channels.values()))
+
+# The SSE feeds are off unless CRICKET_LIVE=1: every open stream holds a
+# worker thread for up to CRICKET_LIVE_MAX_SECONDS, and the broadcaster only
+# reaches streams opened in the process that made the write
+ENABLED = os.environ.get('CRICKET_LIVE', '0') == '1'
+MAX_STREAM_SECONDS = float(os.environ.get('CRICKET_LIVE_MAX_SECONDS', 300))
+
+def format_sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+broadcaster = Broadcaster(buffer_size=int(os.environ.get('CRICKET_LIVE_BUFFER', 64)))
@@ -0,0 +1,267 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Prometheus-style counters and histograms kept in process, plus per-request
+# tallies of SQL work. CRICKET_METRICS=0 turns the SQL and model
+# instrumentation off; CRICKET_SLOW_QUERY_MS logs statements slower than that
+# many milliseconds together with their query plan.
+
+ENABLED = os.environ.get('CRICKET_METRICS', '1') != '0'
+SLOW_QUERY_MS = float(os.environ.get('CRICKET_SLOW_QUERY_MS', 0))
+
+slow_query_log = logging.getLogger('cricket.slow_query')
+
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 10000, 100000)
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(zip(self.labels, key)), value) for key, value in sorted(self._values.items())]
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def count(self):
+        # Observations across every label value
+        with self._lock:
+            return sum(count for _, count, _ in self._values.values())
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, ([*counts], count, total)) for key, (counts, count, total) in self._values.items())
+        samples = []
+        for key, (counts, count, total) in values:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                samples.append((f'{self.name}_bucket', {**labels, 'le': str(bound)}, cumulative))
+            samples.append((f'{self.name}_count', labels, count))
+            samples.append((f'{self.name}_sum', labels, total))
+        return samples
+
+class Gauge:
+    # Read at scrape time from a callable returning {label_values: value}
+    def __init__(self, name, help, labels, collect):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+
+    def samples(self):
+        return [(self.name, dict(zip(self.labels, key)), value) for key, value in sorted(self.collect().items())]
+
+_metrics = []
+
+def register(metric):
+    _metrics.append(metric)
+    return metric
+
+requests_total = register(Counter('cricket_requests_total', 'HTTP requests', ('route', 'status')))
+request_seconds = register(Histogram('cricket_request_seconds', 'Request latency', ('route',)))
+request_queries = register(Histogram('cricket_request_queries', 'SQL statements per request', ('route',),
+                                     COUNT_BUCKETS))
+request_rows = register(Histogram('cricket_request_rows', 'Rows fetched per request', ('route',), COUNT_BUCKETS))
+request_connections = register(Histogram('cricket_request_connections', 'Connection checkouts per request',
+                                         ('route',), COUNT_BUCKETS))
+request_sql_seconds = register(Histogram('cricket_request_sql_seconds', 'Time spent in SQLite per request',
+                                         ('route',)))
+sql_seconds = register(Histogram('cricket_sql_statement_seconds', 'SQL statement latency to first row',
+                                 ('statement',)))
+slow_queries_total = register(Counter('cricket_slow_queries_total', 'Statements over CRICKET_SLOW_QUERY_MS'))
+connections_opened_total = register(Counter('cricket_db_connections_opened_total', 'SQLite connections opened'))
+connection_checkouts_total = register(Counter('cricket_db_connection_checkouts_total',
+                                              'Connections checked out of the pool'))
+model_seconds = register(Histogram('cricket_model_seconds', 'Model method latency', ('method',)))
+chart_seconds = register(Histogram('cricket_chart_seconds', 'Chart building time', ('route',)))
+template_seconds = register(Histogram('cricket_template_seconds', 'Template rendering time', ('template',)))
+
+_local = threading.local()
+
+def begin_request():
+    _local.request = {'queries': 0, 'rows': 0, 'connections': 0, 'sql_seconds': 0.0,
+                      'started': time.perf_counter()}
+
+def end_request(route, status):
+    tally = getattr(_local, 'request', None)
+    if tally is None:
+        return
+    _local.request = None
+    route = route or 'unknown'
+    requests_total.inc(route, str(status))
+    request_seconds.observe(time.perf_counter() - tally['started'], route)
+    request_queries.observe(tally['queries'], route)
+    request_rows.observe(tally['rows'], route)
+    request_connections.observe(tally['connections'], route)
+    request_sql_seconds.observe(tally['sql_seconds'], route)
+
+def current_request():
+    return getattr(_local, 'request', None)
+
+def _statement_kind(sql):
+    words = sql.split(None, 1)
+    return words[0].upper() if words else ''
+
+def _record(connection, sql, parameters, elapsed, rows=0):
+    tally = getattr(_local, 'request', None)
+    if tally is not None:
+        tally['queries'] += 1
+        tally['rows'] += rows
+        tally['sql_seconds'] += elapsed
+    sql_seconds.observe(elapsed, _statement_kind(sql))
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_queries_total.inc()
+        try:
+            plan = [row[-1] for row in sqlite3.Cursor(connection).execute(
+                f'EXPLAIN QUERY PLAN {sql}', parameters)]
+        except (sqlite3.Error, ValueError):
+            plan = []
+        slow_query_log.warning('%.1f ms: %s %r\n  plan: %s', elapsed * 1000, ' '.join(sql.split()),
+                               parameters, '; '.join(plan) or 'n/a')
+
+def _fetched(rows, elapsed):
+    tally = getattr(_local, 'request', None)
+    if tally is not None:
+        tally['rows'] += rows
+        tally['sql_seconds'] += elapsed
+
+class TimedCursor(sqlite3.Cursor):
+    # execute() is timed up to the first row; later fetches add their time and
+    # row counts to the current request
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record(self.connection, sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record(self.connection, sql, (), time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        _fetched(row is not None, time.perf_counter() - started)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        _fetched(len(rows), time.perf_counter() - started)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        _fetched(len(rows), time.perf_counter() - started)
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        row = super().__next__()
+        _fetched(1, time.perf_counter() - started)
+        return row
+
+class TimedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        connections_opened_total.inc()
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def connection_checked_out(conn):
+    connection_checkouts_total.inc()
+    tally = getattr(_local, 'request', None)
+    if tally is not None:
+        tally['connections'] += 1
+
+@contextmanager
+def timer(histogram, *label_values):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started, *label_values)
+
+def instrument(cls):
+    # Class decorator timing every public static method as Class.method
+    if not ENABLED:
+        return cls
+    for name, attribute in list(vars(cls).items()):
+        if name.startswith('_') or not isinstance(attribute, staticmethod):
+            continue
+        setattr(cls, name, staticmethod(_timed(attribute.__func__, f'{cls.__name__}.{name}')))
+    return cls
+
+def _timed(function, label):
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            model_seconds.observe(time.perf_counter() - started, label)
+    return wrapper
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+def render(extra=()):
+    # Prometheus text exposition format (version 0.0.4)
+    lines = []
+    for metric in (*_metrics, *extra):
+        kind = {Counter: 'counter', Histogram: 'histogram', Gauge: 'gauge'}[type(metric)]
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {kind}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
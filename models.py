@@ -1,5 +1,161 @@
-from database import get_db_connection
+import calendar
 
+from cache import cached, stats_cache
+from database import ROLLUPS, get_db_connection, rollup_select
+from live import broadcaster
+from metrics import instrument
+from registry import get_registry, resolve
+from snapshot import get_read_connection, is_pinned, note_write
+
+# Career stats read from the player_*_career summary tables (aliased bat/bowl)
+BATTING_STATS_COLUMNS = '''
+                COALESCE(bat.innings, 0) as {prefix}innings,
+                bat.total_runs as {prefix}total_runs,
+                bat.total_balls as {prefix}total_balls,
+                bat.highest_score as {prefix}highest_score,
+                ROUND(CAST(bat.total_runs AS FLOAT) / bat.innings, 2) as {prefix}average,
+                ROUND(CAST(bat.total_runs AS FLOAT) * 100 / NULLIF(bat.total_balls, 0), 2) as {prefix}strike_rate,
+                bat.total_fours as {prefix}total_fours,
+                bat.total_sixes as {prefix}total_sixes,
+                bat.not_outs as {prefix}not_outs'''
+
+BOWLING_STATS_COLUMNS = '''
+                COALESCE(bowl.innings, 0) as {prefix}innings,
+                bowl.total_overs as {prefix}total_overs,
+                bowl.runs_conceded as {prefix}runs_conceded,
+                bowl.total_wickets as {prefix}total_wickets,
+                ROUND(CAST(bowl.runs_conceded AS FLOAT) / NULLIF(bowl.total_wickets, 0), 2) as {prefix}average,
+                ROUND(CAST(bowl.runs_conceded AS FLOAT) * 6 / NULLIF(bowl.total_overs, 0), 2) as {prefix}economy,
+                bowl.best_bowling as {prefix}best_bowling'''
+
+def _team_tags(team_id, *args, **kwargs):
+    return [('team', int(team_id))]
+
+def _player_tags(player_id, *args, **kwargs):
+    return [('player', int(player_id))]
+
+def _match_tags(match_id, **kwargs):
+    return [('match', int(match_id))]
+
+# data_versions scope behind each kind of tag; a scorecard spans several
+# tables, so it follows the global version
+VERSION_SCOPES = {'team': 'team:{}', 'player': 'player:{}', 'match': 'global'}
+
+def _tag_versions(tags):
+    # Writes from other worker processes cannot invalidate this process's
+    # cache, but they do bump data_versions, which is part of every key
+    scopes = [VERSION_SCOPES[kind].format(entity_id) for kind, entity_id in tags]
+    versions = DataVersion.get(scopes)
+    return tuple(versions[scope][0] for scope in scopes)
+
+def _cached_stats(tags):
+    return cached(stats_cache, tags, bypass=is_pinned, version=_tag_versions)
+
+# Called with the cache tags of every write, e.g. to queue prerendered pages
+write_listeners = []
+
+def _invalidate(teams=(), players=(), matches=()):
+    # Drop cached reads for every team, player and match a write touched
+    tags = [*[('team', int(team_id)) for team_id in teams if team_id],
+            *[('player', int(player_id)) for player_id in players if player_id],
+            *[('match', int(match_id)) for match_id in matches if match_id]]
+    stats_cache.invalidate(*tags)
+    note_write(tags)
+    for listener in write_listeners:
+        listener(tags)
+
+SCORE_FIELDS = ('match_id', 'batting_team_id', 'bowling_team_id', 'innings_number',
+                'total_runs', 'total_wickets', 'total_balls')
+
+def _publish_score(innings, event='score', **extra):
+    # Publish a compact innings delta to the live feeds of its match and both teams
+    data = {'innings_id': innings['id'], **{field: innings[field] for field in SCORE_FIELDS}, **extra}
+    broadcaster.publish([f"match:{innings['match_id']}", f"team:{innings['batting_team_id']}",
+                         f"team:{innings['bowling_team_id']}"], event, data)
+
+# Name columns filled in from the registry, keyed by the id column they label
+MATCH_TEAM_NAMES = {'team1_name': 'team1_id', 'team2_name': 'team2_id'}
+INNINGS_TEAM_NAMES = {'batting_team_name': 'batting_team_id', 'bowling_team_name': 'bowling_team_id'}
+BATTING_PLAYER_NAMES = {'player_name': 'player_id', 'bowler_name': 'bowler_id', 'fielder_name': 'fielder_id'}
+PARTNERSHIP_PLAYER_NAMES = {'batsman1_name': 'batsman1_id', 'batsman2_name': 'batsman2_id'}
+
+def _page(rows, limit, cursor_columns):
+    # Rows were fetched with limit + 1 to see whether another page follows;
+    # the cursor is the sort key of the last row returned
+    rows = rows[:limit + 1]
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, [rows[-1][column] for column in cursor_columns]
+
+def _player_teams(conn, player_ids):
+    player_ids = [player_id for player_id in player_ids if player_id]
+    if not player_ids:
+        return []
+    placeholders = ', '.join('?' * len(player_ids))
+    rows = conn.execute(f'SELECT DISTINCT team_id FROM players WHERE id IN ({placeholders})',
+                        player_ids).fetchall()
+    return [row['team_id'] for row in rows]
+
+def _month_end(month):
+    year, number = int(month[:4]), int(month[5:7])
+    return f'{month}-{calendar.monthrange(year, number)[1]:02d}'
+
+def _add_month(month, step):
+    index = int(month[:4]) * 12 + int(month[5:7]) - 1 + step
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+def _split_range(date_from, date_to):
+    # Whole months inside [date_from, date_to] come from the rollup tables; the
+    # days of a partial first or last month are read from the score rows
+    date_from = date_from or '0000-01-01'
+    date_to = date_to or '9999-12-31'
+    if date_from > date_to:
+        return None, []
+    first, last = date_from[:7], date_to[:7]
+    whole_first = date_from.endswith('-01')
+    whole_last = date_to == _month_end(last)
+    if first == last and not (whole_first and whole_last):
+        return None, [(date_from, date_to)]
+    days = []
+    if not whole_first:
+        days.append((date_from, _month_end(first)))
+        first = _add_month(first, 1)
+    if not whole_last:
+        days.append((f'{last}-01', date_to))
+        last = _add_month(last, -1)
+    return ((first, last) if first <= last else None), days
+
+def _ranged(kind, date_from, date_to, key_filter='', key_params=()):
+    # Totals per player (or team) over a date range as a subquery shaped like
+    # the career tables; key_filter (e.g. '= ?') limits it to the keys needed
+    rollup = ROLLUPS[kind]
+    key = rollup['key']
+    names = ', '.join(name for name, _, _ in rollup['columns'])
+    months, days = _split_range(date_from, date_to)
+    parts, params = [], []
+    if months:
+        where = f'AND {key} {key_filter}' if key_filter else ''
+        parts.append(f'''
+                SELECT {key}, {names} FROM {rollup['table']}
+                WHERE month BETWEEN ? AND ? {where}''')
+        params += [*months, *key_params]
+    for day_from, day_to in days:
+        where = 'm.match_date BETWEEN ? AND ?'
+        if key_filter:
+            where += f" AND {rollup['source_key']} {key_filter}"
+        parts.append(f"SELECT {key}, {names} FROM ({rollup_select(kind, where)})")
+        params += [day_from, day_to, *key_params]
+    if not parts:
+        parts.append(f"SELECT {key}, {names} FROM {rollup['table']} WHERE 0")
+    totals = ', '.join(f'{combine}({name}) as {name}' for name, combine, _ in rollup['columns'])
+    return f'''(
+            SELECT {key}, {totals}
+            FROM ({' UNION ALL '.join(parts)})
+            GROUP BY {key}
+        )''', params
+
+@instrument
 class Team:
     @staticmethod
     def create(name):
@@ -8,26 +164,49 @@ class Team:
         cursor.execute('INSERT INTO teams (name) VALUES (?)', (name,))
         conn.commit()
         team_id = cursor.lastrowid
-        conn.close()
+        get_registry().catch_up(conn)
+        _invalidate(teams=[team_id])
         return team_id
     
     @staticmethod
     def get_all():
+        # Ids and names for pickers, from the in-process registry
+        return get_registry().sorted_teams()
+    
+    @staticmethod
+    def get_page(after=None, limit=20):
+        # Keyset page ordered by name; after is the cursor of the previous page
         conn = get_db_connection()
-        teams = conn.execute('SELECT * FROM teams ORDER BY name').fetchall()
-        conn.close()
-        return teams
+        if after:
+            teams = conn.execute('''
+                SELECT * FROM teams WHERE name > ? ORDER BY name LIMIT ?
+            ''', (after[0], limit + 1)).fetchall()
+        else:
+            teams = conn.execute('SELECT * FROM teams ORDER BY name LIMIT ?', (limit + 1,)).fetchall()
+        return _page(teams, limit, ['name'])
     
     @staticmethod
     def get_by_id(team_id):
         conn = get_db_connection()
         team = conn.execute('SELECT * FROM teams WHERE id = ?', (team_id,)).fetchone()
-        conn.close()
         return team
     
     @staticmethod
-    def get_statistics(team_id):
-        conn = get_db_connection()
+    @_cached_stats(_team_tags)
+    def get_statistics(team_id, date_from=None, date_to=None):
+        conn = get_read_connection()
+        if date_from or date_to:
+            source, params = _ranged('team', date_from, date_to, '= ?', [team_id])
+            stats = conn.execute(f'''
+                SELECT 
+                    COALESCE(r.matches_played, 0) as matches_played,
+                    r.total_runs,
+                    r.total_wickets,
+                    ROUND(CAST(r.total_runs AS FLOAT) / r.innings, 2) as avg_runs_per_innings
+                FROM (SELECT ? as id) t
+                LEFT JOIN {source} r ON r.team_id = t.id
+            ''', [team_id] + params).fetchone()
+            return dict(stats)
         
         # Total matches, runs, wickets
         stats = conn.execute('''
@@ -40,9 +219,9 @@ class Team:
             WHERE i.batting_team_id = ?
         ''', (team_id,)).fetchone()
         
-        conn.close()
         return dict(stats)
 
+@instrument
 class Player:
     @staticmethod
     def create(name, team_id, role):
@@ -52,80 +231,170 @@ class Player:
                       (name, team_id, role))
         conn.commit()
         player_id = cursor.lastrowid
-        conn.close()
+        get_registry().catch_up(conn)
+        _invalidate(teams=[team_id], players=[player_id])
         return player_id
     
     @staticmethod
     def get_all():
         conn = get_db_connection()
-        players = conn.execute('''
+        players = resolve(conn.execute('SELECT * FROM players').fetchall(), teams={'team_name': 'team_id'})
+        players.sort(key=lambda player: (player['team_name'], player['name']))
+        return players
+    
+    @staticmethod
+    def get_page(after=None, limit=20):
+        # Keyset page ordered by (team name, player name); a name is unique within a team
+        conn = get_db_connection()
+        where, params = '', []
+        if after:
+            where = 'WHERE t.name >= ? AND (t.name > ? OR p.name > ?)'
+            params = [after[0], after[0], after[1]]
+        players = conn.execute(f'''
             SELECT p.*, t.name as team_name 
-            FROM players p
-            JOIN teams t ON p.team_id = t.id
+            FROM teams t
+            JOIN players p ON p.team_id = t.id
+            {where}
             ORDER BY t.name, p.name
-        ''').fetchall()
-        conn.close()
-        return players
+            LIMIT ?
+        ''', params + [limit + 1]).fetchall()
+        return _page(players, limit, ['team_name', 'name'])
     
     @staticmethod
-    def get_by_team(team_id):
+    def search(query, team_id=None, role=None, limit=10):
+        # Names starting with query come first, then names containing it. Queries
+        # of three or more characters go through the trigram index in players_fts;
+        # shorter ones can only be prefixes and use the NOCASE name index.
         conn = get_db_connection()
+        filters, params = [], []
+        if team_id is not None:
+            filters.append('p.team_id = ?')
+            params.append(team_id)
+        if role is not None:
+            filters.append('p.role = ?')
+            params.append(role)
+        
+        prefix = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        if len(query) >= 3:
+            source = 'players_fts f JOIN players p ON p.id = f.rowid'
+            filters.insert(0, 'players_fts MATCH ?')
+            params.insert(0, '"' + query.replace('"', '""') + '"')
+            order = "p.name LIKE ? ESCAPE '\\' DESC, p.name COLLATE NOCASE"
+            params.append(prefix)
+        else:
+            source = 'players p'
+            filters.insert(0, "p.name LIKE ? ESCAPE '\\'")
+            params.insert(0, prefix)
+            order = 'p.name COLLATE NOCASE'
+        
+        players = conn.execute(f'''
+            SELECT p.id, p.name, p.team_id, p.role
+            FROM {source}
+            WHERE {' AND '.join(filters)}
+            ORDER BY {order}
+            LIMIT ?
+        ''', params + [limit]).fetchall()
+        return resolve(players, teams={'team_name': 'team_id'})
+    
+    @staticmethod
+    def get_by_team(team_id):
+        # Read where get_stats_by_team reads, so the dashboard's roster and its
+        # stats come from the same copy of the data
+        conn = get_read_connection()
         players = conn.execute('''
             SELECT * FROM players WHERE team_id = ? ORDER BY name
         ''', (team_id,)).fetchall()
-        conn.close()
         return players
     
     @staticmethod
     def get_by_id(player_id):
         conn = get_db_connection()
-        player = conn.execute('''
-            SELECT p.*, t.name as team_name 
-            FROM players p
-            JOIN teams t ON p.team_id = t.id
-            WHERE p.id = ?
-        ''', (player_id,)).fetchone()
-        conn.close()
-        return player
+        player = conn.execute('SELECT * FROM players WHERE id = ?', (player_id,)).fetchone()
+        if player is None:
+            return None
+        return resolve([player], teams={'team_name': 'team_id'})[0]
     
     @staticmethod
-    def get_batting_stats(player_id):
-        conn = get_db_connection()
-        stats = conn.execute('''
-            SELECT 
-                COUNT(*) as innings,
-                SUM(runs_scored) as total_runs,
-                SUM(balls_faced) as total_balls,
-                MAX(runs_scored) as highest_score,
-                ROUND(AVG(runs_scored), 2) as average,
-                ROUND(CAST(SUM(runs_scored) AS FLOAT) * 100 / NULLIF(SUM(balls_faced), 0), 2) as strike_rate,
-                SUM(fours) as total_fours,
-                SUM(sixes) as total_sixes,
-                SUM(CASE WHEN is_out = 0 THEN 1 ELSE 0 END) as not_outs
-            FROM batting_scores
-            WHERE player_id = ?
-        ''', (player_id,)).fetchone()
-        conn.close()
+    @_cached_stats(_player_tags)
+    def get_batting_stats(player_id, date_from=None, date_to=None):
+        conn = get_read_connection()
+        source, params = 'player_batting_career', []
+        if date_from or date_to:
+            source, params = _ranged('batting', date_from, date_to, '= ?', [player_id])
+        stats = conn.execute(f'''
+            SELECT {BATTING_STATS_COLUMNS.format(prefix='')}
+            FROM (SELECT ? as id) p
+            LEFT JOIN {source} bat ON bat.player_id = p.id
+        ''', [player_id] + params).fetchone()
         return dict(stats) if stats else {}
     
     @staticmethod
-    def get_bowling_stats(player_id):
-        conn = get_db_connection()
-        stats = conn.execute('''
-            SELECT 
-                COUNT(*) as innings,
-                SUM(overs) as total_overs,
-                SUM(runs_conceded) as runs_conceded,
-                SUM(wickets) as total_wickets,
-                ROUND(CAST(SUM(runs_conceded) AS FLOAT) / NULLIF(SUM(wickets), 0), 2) as average,
-                ROUND(CAST(SUM(runs_conceded) AS FLOAT) * 6 / NULLIF(SUM(overs), 0), 2) as economy,
-                MAX(wickets) as best_bowling
-            FROM bowling_figures
-            WHERE bowler_id = ?
-        ''', (player_id,)).fetchone()
-        conn.close()
+    @_cached_stats(_player_tags)
+    def get_bowling_stats(player_id, date_from=None, date_to=None):
+        conn = get_read_connection()
+        source, params = 'player_bowling_career', []
+        if date_from or date_to:
+            source, params = _ranged('bowling', date_from, date_to, '= ?', [player_id])
+        stats = conn.execute(f'''
+            SELECT {BOWLING_STATS_COLUMNS.format(prefix='')}
+            FROM (SELECT ? as id) p
+            LEFT JOIN {source} bowl ON bowl.player_id = p.id
+        ''', [player_id] + params).fetchone()
         return dict(stats) if stats else {}
+    
+    @staticmethod
+    @_cached_stats(_team_tags)
+    def get_stats_by_team(team_id, date_from=None, date_to=None):
+        return Player._get_bulk_stats('p.team_id = ?', (team_id,), date_from, date_to)
+    
+    @staticmethod
+    def _get_bulk_stats(where, params, date_from=None, date_to=None):
+        # Batting and bowling career stats for many players in one query,
+        # keyed by player id with the same shape as get_batting_stats/get_bowling_stats
+        conn = get_read_connection()
+        batting, bowling, range_params = 'player_batting_career', 'player_bowling_career', []
+        if date_from or date_to:
+            players = f'IN (SELECT p.id FROM players p WHERE {where})'
+            batting, batting_params = _ranged('batting', date_from, date_to, players, params)
+            bowling, bowling_params = _ranged('bowling', date_from, date_to, players, params)
+            range_params = batting_params + bowling_params
+        rows = conn.execute(f'''
+            SELECT 
+                p.id as player_id,
+                {BATTING_STATS_COLUMNS.format(prefix='bat_')},
+                {BOWLING_STATS_COLUMNS.format(prefix='bowl_')}
+            FROM players p
+            LEFT JOIN {batting} bat ON bat.player_id = p.id
+            LEFT JOIN {bowling} bowl ON bowl.player_id = p.id
+            WHERE {where}
+        ''', range_params + list(params)).fetchall()
+        
+        stats = {}
+        for row in rows:
+            row = dict(row)
+            stats[row['player_id']] = {
+                'batting': {k[len('bat_'):]: v for k, v in row.items() if k.startswith('bat_')},
+                'bowling': {k[len('bowl_'):]: v for k, v in row.items() if k.startswith('bowl_')},
+            }
+        return stats
+
+@instrument
+class DataVersion:
+    @staticmethod
+    def get(scopes):
+        # Current version and last change time of each scope ('global',
+        # 'team:<id>', 'player:<id>'); scopes never written to are at version 0
+        scopes = list(scopes)
+        conn = get_read_connection()
+        placeholders = ', '.join('?' * len(scopes))
+        rows = conn.execute(f'''
+            SELECT scope, version, updated_at FROM data_versions WHERE scope IN ({placeholders})
+        ''', scopes).fetchall()
+        versions = {scope: (0, None) for scope in scopes}
+        versions.update({row['scope']: (row['version'], row['updated_at']) for row in rows})
+        return versions
 
+@instrument
 class Match:
     @staticmethod
     def create(team1_id, team2_id, match_date, venue):
@@ -137,24 +406,79 @@ class Match:
         ''', (team1_id, team2_id, match_date, venue))
         conn.commit()
         match_id = cursor.lastrowid
-        conn.close()
         return match_id
     
     @staticmethod
     def get_all():
         conn = get_db_connection()
         matches = conn.execute('''
-            SELECT m.*, 
-                   t1.name as team1_name, 
-                   t2.name as team2_name
-            FROM matches m
-            JOIN teams t1 ON m.team1_id = t1.id
-            JOIN teams t2 ON m.team2_id = t2.id
-            ORDER BY m.match_date DESC
+            SELECT * FROM matches ORDER BY match_date DESC
         ''').fetchall()
-        conn.close()
-        return matches
+        return resolve(matches, teams=MATCH_TEAM_NAMES)
+    
+    @staticmethod
+    def get_page(after=None, limit=20):
+        # Keyset page ordered by match_date DESC, newest id first within a day
+        conn = get_db_connection()
+        where, params = '', []
+        if after:
+            where = 'WHERE (m.match_date, m.id) < (?, ?)'
+            params = [after[0], after[1]]
+        matches = conn.execute(f'''
+            SELECT m.*
+            FROM matches m
+            {where}
+            ORDER BY m.match_date DESC, m.id DESC
+            LIMIT ?
+        ''', params + [limit + 1]).fetchall()
+        return _page(resolve(matches, teams=MATCH_TEAM_NAMES), limit, ['match_date', 'id'])
+    
+    @staticmethod
+    @_cached_stats(_match_tags)
+    def get_scorecard(match_id):
+        # The whole scorecard in five queries however many innings there are:
+        # match, innings, then batting, bowling and partnerships for all innings
+        conn = get_read_connection()
+        match = conn.execute('SELECT * FROM matches WHERE id = ?', (match_id,)).fetchone()
+        if match is None:
+            return None
+        innings = conn.execute('''
+            SELECT * FROM innings WHERE match_id = ? ORDER BY innings_number, id
+        ''', (match_id,)).fetchall()
+        batting = conn.execute('''
+            SELECT bs.*
+            FROM innings i
+            JOIN batting_scores bs ON bs.innings_id = i.id
+            WHERE i.match_id = ?
+            ORDER BY bs.innings_id, bs.batting_position, bs.id
+        ''', (match_id,)).fetchall()
+        bowling = conn.execute('''
+            SELECT bf.*
+            FROM innings i
+            JOIN bowling_figures bf ON bf.innings_id = i.id
+            WHERE i.match_id = ?
+            ORDER BY bf.innings_id, bf.id
+        ''', (match_id,)).fetchall()
+        partnerships = conn.execute('''
+            SELECT pt.*
+            FROM innings i
+            JOIN partnerships pt ON pt.innings_id = i.id
+            WHERE i.match_id = ?
+            ORDER BY pt.innings_id, pt.wicket_number
+        ''', (match_id,)).fetchall()
+        
+        innings = resolve(innings, teams=INNINGS_TEAM_NAMES)
+        batting = resolve(batting, players=BATTING_PLAYER_NAMES)
+        bowling = resolve(bowling, players={'bowler_name': 'bowler_id'})
+        partnerships = resolve(partnerships, players=PARTNERSHIP_PLAYER_NAMES)
+        scorecard = {row['id']: {**row, 'batting': [], 'bowling': [], 'partnerships': []}
+                     for row in innings}
+        for key, rows in (('batting', batting), ('bowling', bowling), ('partnerships', partnerships)):
+            for row in rows:
+                scorecard[row['innings_id']][key].append(row)
+        return {'match': resolve([match], teams=MATCH_TEAM_NAMES)[0], 'innings': list(scorecard.values())}
 
+@instrument
 class Innings:
     @staticmethod
     def create(match_id, batting_team_id, bowling_team_id, innings_number):
@@ -166,16 +490,71 @@ class Innings:
         ''', (match_id, batting_team_id, bowling_team_id, innings_number))
         conn.commit()
         innings_id = cursor.lastrowid
-        conn.close()
+        _invalidate(teams=[batting_team_id, bowling_team_id], matches=[match_id])
+        _publish_score(Innings.get_by_id(innings_id))
+        return innings_id
+    
+    @staticmethod
+    def create_scorecard(match_id, batting_team_id, bowling_team_id, innings_number,
+                         batting_scores=(), bowling_figures=(), new_match=None):
+        # batting_scores rows: (player_id, runs_scored, balls_faced, fours, sixes, is_out,
+        #   dismissal_type, bowler_id, fielder_id, partnership_runs, batting_position)
+        # bowling_figures rows: (bowler_id, overs, maidens, runs_conceded, wickets)
+        # new_match: (team1_id, team2_id, match_date, venue) to create the match too,
+        #   in which case match_id is ignored
+        # Everything is written in one transaction; any failure rolls the innings
+        # (and the new match) back. Empty bowler and fielder ids are stored as NULL.
+        batting_scores = [(*row[:7], row[7] or None, row[8] or None, *row[9:]) for row in batting_scores]
+        conn = get_db_connection()
+        with conn:
+            cursor = conn.cursor()
+            if new_match is not None:
+                cursor.execute('''
+                    INSERT INTO matches (team1_id, team2_id, match_date, venue)
+                    VALUES (?, ?, ?, ?)
+                ''', new_match)
+                match_id = cursor.lastrowid
+            cursor.execute('''
+                INSERT INTO innings (match_id, batting_team_id, bowling_team_id, innings_number)
+                VALUES (?, ?, ?, ?)
+            ''', (match_id, batting_team_id, bowling_team_id, innings_number))
+            innings_id = cursor.lastrowid
+            
+            cursor.executemany('''
+                INSERT INTO batting_scores 
+                (innings_id, player_id, runs_scored, balls_faced, fours, sixes, 
+                 is_out, dismissal_type, bowler_id, fielder_id, partnership_runs, batting_position)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(innings_id, *row) for row in batting_scores])
+            
+            cursor.executemany('''
+                INSERT INTO bowling_figures 
+                (innings_id, bowler_id, overs, maidens, runs_conceded, wickets)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(innings_id, *row) for row in bowling_figures])
+            
+            # Update innings totals once for the whole scorecard
+            cursor.execute('''
+                UPDATE innings 
+                SET total_runs = COALESCE((SELECT SUM(runs_scored) FROM batting_scores WHERE innings_id = ?), 0),
+                    total_wickets = COALESCE((SELECT SUM(is_out) FROM batting_scores WHERE innings_id = ?), 0),
+                    total_balls = COALESCE((SELECT SUM(balls_faced) FROM batting_scores WHERE innings_id = ?), 0)
+                WHERE id = ?
+            ''', (innings_id, innings_id, innings_id, innings_id))
+        
+        player_ids = [row[0] for row in batting_scores] + [row[0] for row in bowling_figures]
+        _invalidate(teams=[batting_team_id, bowling_team_id, *_player_teams(conn, player_ids)],
+                    players=player_ids, matches=[match_id])
+        _publish_score(Innings.get_by_id(innings_id))
         return innings_id
     
     @staticmethod
     def get_by_id(innings_id):
         conn = get_db_connection()
         innings = conn.execute('SELECT * FROM innings WHERE id = ?', (innings_id,)).fetchone()
-        conn.close()
         return innings
 
+@instrument
 class BattingScore:
     @staticmethod
     def create(innings_id, player_id, runs_scored, balls_faced, fours, sixes,
@@ -201,26 +580,22 @@ class BattingScore:
             WHERE id = ?
         ''', (innings_id, innings_id, innings_id, innings_id))
         conn.commit()
-        conn.close()
+        
+        innings = Innings.get_by_id(innings_id)
+        _invalidate(teams=[innings['batting_team_id'] if innings else None, *_player_teams(conn, [player_id])],
+                    players=[player_id], matches=[innings['match_id'] if innings else None])
+        if innings:
+            _publish_score(innings)
     
     @staticmethod
     def get_by_innings(innings_id):
         conn = get_db_connection()
         scores = conn.execute('''
-            SELECT bs.*, 
-                   p.name as player_name,
-                   b.name as bowler_name,
-                   f.name as fielder_name
-            FROM batting_scores bs
-            JOIN players p ON bs.player_id = p.id
-            LEFT JOIN players b ON bs.bowler_id = b.id
-            LEFT JOIN players f ON bs.fielder_id = f.id
-            WHERE bs.innings_id = ?
-            ORDER BY bs.batting_position
+            SELECT * FROM batting_scores WHERE innings_id = ? ORDER BY batting_position
         ''', (innings_id,)).fetchall()
-        conn.close()
-        return scores
+        return resolve(scores, players=BATTING_PLAYER_NAMES)
 
+@instrument
 class BowlingFigure:
     @staticmethod
     def create(innings_id, bowler_id, overs, maidens, runs_conceded, wickets):
@@ -232,20 +607,22 @@ class BowlingFigure:
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (innings_id, bowler_id, overs, maidens, runs_conceded, wickets))
         conn.commit()
-        conn.close()
+        innings = Innings.get_by_id(innings_id)
+        _invalidate(teams=_player_teams(conn, [bowler_id]), players=[bowler_id],
+                    matches=[innings['match_id'] if innings else None])
+        if innings:
+            _publish_score(innings, 'bowling', bowler_id=bowler_id, overs=overs, maidens=maidens,
+                           runs_conceded=runs_conceded, wickets=wickets)
     
     @staticmethod
     def get_by_innings(innings_id):
         conn = get_db_connection()
         figures = conn.execute('''
-            SELECT bf.*, p.name as bowler_name
-            FROM bowling_figures bf
-            JOIN players p ON bf.bowler_id = p.id
-            WHERE bf.innings_id = ?
+            SELECT * FROM bowling_figures WHERE innings_id = ?
         ''', (innings_id,)).fetchall()
-        conn.close()
-        return figures
+        return resolve(figures, players={'bowler_name': 'bowler_id'})
 
+@instrument
 class Partnership:
     @staticmethod
     def create(innings_id, batsman1_id, batsman2_id, runs, balls, wicket_number):
@@ -257,20 +634,242 @@ class Partnership:
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (innings_id, batsman1_id, batsman2_id, runs, balls, wicket_number))
         conn.commit()
-        conn.close()
+        innings = Innings.get_by_id(innings_id)
+        _invalidate(matches=[innings['match_id'] if innings else None])
     
     @staticmethod
     def get_by_innings(innings_id):
         conn = get_db_connection()
         partnerships = conn.execute('''
-            SELECT p.*, 
-                   p1.name as batsman1_name,
-                   p2.name as batsman2_name
-            FROM partnerships p
-            JOIN players p1 ON p.batsman1_id = p1.id
-            JOIN players p2 ON p.batsman2_id = p2.id
-            WHERE p.innings_id = ?
-            ORDER BY p.wicket_number
+            SELECT * FROM partnerships WHERE innings_id = ? ORDER BY wicket_number
         ''', (innings_id,)).fetchall()
-        conn.close()
-        return partnerships
+        return resolve(partnerships, players=PARTNERSHIP_PLAYER_NAMES)
+
+@instrument
+class Delivery:
+    # Dismissals that are not credited to the bowler
+    NON_BOWLER_DISMISSALS = {'run out', 'retired hurt', 'retired out', 'obstructing the field'}
+    
+    @staticmethod
+    def create(innings_id, batsman_id, bowler_id, runs_batter=0, extras=0, extra_type=None,
+               non_striker_id=None, is_wicket=False, dismissal_type=None, player_out_id=None,
+               fielder_id=None):
+        return Delivery.create_many(innings_id, [{
+            'batsman_id': batsman_id, 'bowler_id': bowler_id, 'runs_batter': runs_batter,
+            'extras': extras, 'extra_type': extra_type, 'non_striker_id': non_striker_id,
+            'is_wicket': is_wicket, 'dismissal_type': dismissal_type,
+            'player_out_id': player_out_id, 'fielder_id': fielder_id,
+        }])[0]
+    
+    @staticmethod
+    def create_many(innings_id, balls):
+        # Append balls to a live innings. Each ball updates the batting, bowling,
+        # partnership and innings rows it affects by delta, so the cost per ball is
+        # a handful of indexed writes no matter how long the innings is. The batch
+        # is one transaction.
+        conn = get_db_connection()
+        delivery_ids = []
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            innings = conn.execute('SELECT * FROM innings WHERE id = ?', (innings_id,)).fetchone()
+            if innings is None:
+                raise ValueError(f'Unknown innings {innings_id}')
+            state = {
+                'total_runs': innings['total_runs'] or 0,
+                'total_wickets': innings['total_wickets'] or 0,
+                'total_balls': innings['total_balls'] or 0,
+                'batters': set(),
+                'bowlers': {},
+                'partnership': None,
+            }
+            for ball in balls:
+                delivery_ids.append(Delivery._apply(conn, innings_id, state, ball))
+            conn.execute('''
+                UPDATE innings SET total_runs = ?, total_wickets = ?, total_balls = ? WHERE id = ?
+            ''', (state['total_runs'], state['total_wickets'], state['total_balls'], innings_id))
+        
+        _publish_score({**dict(innings), **{field: state[field] for field in
+                                            ('total_runs', 'total_wickets', 'total_balls')}},
+                       balls=len(delivery_ids))
+        player_ids = state['batters'] | set(state['bowlers'])
+        _invalidate(teams=[innings['batting_team_id'], innings['bowling_team_id'],
+                           *_player_teams(conn, player_ids)],
+                    players=player_ids, matches=[innings['match_id']])
+        return delivery_ids
+    
+    @staticmethod
+    def _apply(conn, innings_id, state, ball):
+        batsman_id = ball['batsman_id']
+        bowler_id = ball['bowler_id']
+        non_striker_id = ball.get('non_striker_id')
+        runs_batter = int(ball.get('runs_batter') or 0)
+        extras = int(ball.get('extras') or 0)
+        extra_type = ball.get('extra_type') or None
+        is_wicket = bool(ball.get('is_wicket'))
+        dismissal_type = ball.get('dismissal_type') if is_wicket else None
+        player_out_id = (ball.get('player_out_id') or batsman_id) if is_wicket else None
+        fielder_id = ball.get('fielder_id') if is_wicket else None
+        if extra_type not in (None, 'wide', 'noball', 'bye', 'legbye'):
+            raise ValueError(f'Unknown extra type {extra_type!r}')
+        
+        legal = extra_type not in ('wide', 'noball')
+        charged = runs_batter + (extras if extra_type in (None, 'wide', 'noball') else 0)
+        bowler_wicket = is_wicket and (dismissal_type or '').lower() not in Delivery.NON_BOWLER_DISMISSALS
+        over_number, ball_number = divmod(state['total_balls'], 6)
+        
+        delivery_id = conn.execute('''
+            INSERT INTO deliveries
+            (innings_id, over_number, ball_number, batsman_id, non_striker_id, bowler_id,
+             runs_batter, extras, extra_type, is_wicket, dismissal_type, player_out_id, fielder_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (innings_id, over_number, ball_number + 1, batsman_id, non_striker_id, bowler_id,
+              runs_batter, extras, extra_type, is_wicket, dismissal_type, player_out_id, fielder_id)).lastrowid
+        
+        # Batting: the striker's row, plus the non-striker's so both have a position
+        for player_id in (batsman_id, non_striker_id):
+            if player_id and player_id not in state['batters']:
+                conn.execute('''
+                    INSERT INTO batting_scores (innings_id, player_id, batting_position)
+                    SELECT ?, ?, (SELECT COUNT(*) + 1 FROM batting_scores WHERE innings_id = ?)
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM batting_scores WHERE innings_id = ? AND player_id = ?
+                    )
+                ''', (innings_id, player_id, innings_id, innings_id, player_id))
+                state['batters'].add(player_id)
+        conn.execute('''
+            UPDATE batting_scores SET
+                runs_scored = runs_scored + ?,
+                balls_faced = balls_faced + ?,
+                fours = fours + ?,
+                sixes = sixes + ?
+            WHERE innings_id = ? AND player_id = ?
+        ''', (runs_batter, int(extra_type != 'wide'), int(runs_batter == 4), int(runs_batter == 6),
+              innings_id, batsman_id))
+        if is_wicket:
+            conn.execute('''
+                UPDATE batting_scores SET is_out = 1, dismissal_type = ?, bowler_id = ?, fielder_id = ?
+                WHERE innings_id = ? AND player_id = ?
+            ''', (dismissal_type, bowler_id if bowler_wicket else None, fielder_id,
+                  innings_id, player_out_id))
+        
+        # Bowling: overs are kept in cricket notation (4.3 = four overs and three balls)
+        bowler = state['bowlers'].get(bowler_id)
+        if bowler is None:
+            row = conn.execute('''
+                SELECT id, overs FROM bowling_figures WHERE innings_id = ? AND bowler_id = ?
+            ''', (innings_id, bowler_id)).fetchone()
+            if row is None:
+                row = {'id': conn.execute('''
+                    INSERT INTO bowling_figures (innings_id, bowler_id) VALUES (?, ?)
+                ''', (innings_id, bowler_id)).lastrowid, 'overs': 0}
+            whole_overs = int(row['overs'] or 0)
+            bowler = state['bowlers'][bowler_id] = {
+                'id': row['id'],
+                'balls': whole_overs * 6 + round(((row['overs'] or 0) - whole_overs) * 10),
+            }
+        bowler['balls'] += legal
+        maiden = 0
+        if legal and bowler['balls'] % 6 == 0:
+            over_runs = conn.execute('''
+                SELECT SUM(runs_batter + CASE WHEN extra_type IN ('bye', 'legbye') THEN 0 ELSE extras END)
+                FROM deliveries WHERE innings_id = ? AND over_number = ? AND bowler_id = ?
+            ''', (innings_id, over_number, bowler_id)).fetchone()[0]
+            maiden = int(not over_runs)
+        conn.execute('''
+            UPDATE bowling_figures SET
+                overs = ?,
+                maidens = maidens + ?,
+                runs_conceded = runs_conceded + ?,
+                wickets = wickets + ?
+            WHERE id = ?
+        ''', (bowler['balls'] // 6 + (bowler['balls'] % 6) / 10, maiden, charged,
+              int(bowler_wicket), bowler['id']))
+        
+        # Partnership for the current wicket, started on its first ball
+        if non_striker_id:
+            wicket_number = state['total_wickets'] + 1
+            partnership = state['partnership']
+            if partnership is None or partnership['wicket_number'] != wicket_number:
+                row = conn.execute('''
+                    SELECT id FROM partnerships WHERE innings_id = ? AND wicket_number = ?
+                ''', (innings_id, wicket_number)).fetchone()
+                if row is None:
+                    row = {'id': conn.execute('''
+                        INSERT INTO partnerships (innings_id, batsman1_id, batsman2_id, wicket_number)
+                        VALUES (?, ?, ?, ?)
+                    ''', (innings_id, batsman_id, non_striker_id, wicket_number)).lastrowid}
+                partnership = state['partnership'] = {'id': row['id'], 'wicket_number': wicket_number}
+            conn.execute('''
+                UPDATE partnerships SET runs = runs + ?, balls = balls + ? WHERE id = ?
+            ''', (runs_batter + extras, int(legal), partnership['id']))
+        
+        state['total_runs'] += runs_batter + extras
+        state['total_wickets'] += int(is_wicket)
+        state['total_balls'] += int(legal)
+        return delivery_id
+
+@instrument
+class Leaderboard:
+    # Each ranking reads the incrementally maintained career tables in the order
+    # of an index on its ranking expression, so top-N stops after N qualifying
+    # rows. A date range has no precomputed ranking; it sums the monthly
+    # rollups inside it plus the score rows of any partial edge month.
+    CATEGORIES = {
+        'runs': {
+            'title': 'Most Runs', 'kind': 'batting', 'label': 'Runs',
+            'value': 'c.total_runs', 'order': 'DESC',
+        },
+        'wickets': {
+            'title': 'Most Wickets', 'kind': 'bowling', 'label': 'Wickets',
+            'value': 'c.total_wickets', 'order': 'DESC',
+        },
+        'average': {
+            'title': 'Best Batting Average', 'kind': 'batting', 'label': 'Average',
+            'value': 'CAST(c.total_runs AS REAL) / c.innings', 'order': 'DESC', 'ratio': True,
+        },
+        'strike_rate': {
+            'title': 'Best Strike Rate', 'kind': 'batting', 'label': 'Strike Rate',
+            'value': 'CAST(c.total_runs AS REAL) * 100 / c.total_balls', 'order': 'DESC', 'ratio': True,
+        },
+        'economy': {
+            'title': 'Best Economy', 'kind': 'bowling', 'label': 'Economy',
+            'value': 'CAST(c.runs_conceded AS REAL) * 6 / c.total_overs', 'order': 'ASC', 'ratio': True,
+        },
+    }
+    
+    SOURCES = {
+        'batting': 'player_batting_career',
+        'bowling': 'player_bowling_career',
+    }
+    
+    @staticmethod
+    def get(category, limit=10, min_innings=1, team_id=None, date_from=None, date_to=None):
+        spec = Leaderboard.CATEGORIES[category]
+        source, params = Leaderboard.SOURCES[spec['kind']], []
+        if date_from or date_to:
+            source, params = _ranged(spec['kind'], date_from, date_to)
+        
+        filters, join = ['c.innings >= ?', f"{spec['value']} IS NOT NULL"], ''
+        params.append(min_innings)
+        if team_id is not None:
+            join = 'JOIN players p ON p.id = c.player_id'
+            filters.append('p.team_id = ?')
+            params.append(team_id)
+        
+        value = f"ROUND({spec['value']}, 2)" if spec.get('ratio') else spec['value']
+        conn = get_read_connection()
+        rows = conn.execute(f'''
+            SELECT c.*, {value} as value
+            FROM {source} c
+            {join}
+            WHERE {' AND '.join(filters)}
+            ORDER BY {spec['value']} {spec['order']}
+            LIMIT ?
+        ''', params + [limit]).fetchall()
+        registry = get_registry()
+        leaders = []
+        for rank, row in enumerate(rows, start=1):
+            player_team_id = registry.player_team_id(row['player_id'])
+            leaders.append(dict(row, rank=rank, player_name=registry.player_name(row['player_id']),
+                                team_id=player_team_id, team_name=registry.team_name(player_team_id)))
+        return leaders
@@ -0,0 +1,223 @@
+import argparse
+import glob
+import gzip
+import inspect
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import send_file
+from werkzeug.exceptions import NotFound
+
+import metrics
+from database import get_db_connection
+from models import DataVersion
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Team and player dashboards rendered ahead of time into CRICKET_PRERENDER,
+# one file per data version, plus gzip and (with the brotli package) brotli
+# copies. Writes queue the pages they affect for a background thread to
+# re-render; the routes serve the file for the current version when there is
+# one and fall back to rendering otherwise.
+#
+#   python prerender.py build [--jobs N] [--kind team|player]
+#
+# renders every page of a database in parallel worker processes.
+
+ROOT = os.environ.get('CRICKET_PRERENDER') or None
+
+VIEWS = {'team': 'dashboard.team_dashboard', 'player': 'dashboard.player_dashboard'}
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+served_total = metrics.register(metrics.Counter('cricket_prerender_served_total',
+                                                'Dashboard requests by prerendered file use',
+                                                ('kind', 'result')))
+render_seconds = metrics.register(metrics.Histogram('cricket_prerender_render_seconds',
+                                                    'Time to render and compress one page', ('kind',)))
+pending_gauge = metrics.register(metrics.Gauge('cricket_prerender_pending', 'Pages queued for rendering', (),
+                                               lambda: {(): pending()} if ROOT is not None else {}))
+
+_app = None
+_queue = {}
+_state = {'pid': None}
+_lock = threading.Lock()
+_wake = threading.Event()
+
+def init_app(app, root=None):
+    global ROOT, _app
+    if root is not None:
+        ROOT = root or None
+    _app = app
+
+def page_path(kind, entity_id, version):
+    return os.path.join(ROOT, kind, f'{entity_id}.v{version}.html')
+
+def _write(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def render(app, kind, entity_id):
+    # Render one page the way its route would for a plain GET and store it with
+    # its compressed copies; returns the version written, None if there is no
+    # such team or player
+    started = time.perf_counter()
+    view = inspect.unwrap(app.view_functions[VIEWS[kind]])
+    scope = f'{kind}:{entity_id}'
+    with app.test_request_context(f'/{kind}/{entity_id}'):
+        # The version is read before the page so a file is never labelled
+        # newer than what it shows
+        version = DataVersion.get([scope])[scope][0]
+        path = page_path(kind, entity_id, version)
+        if os.path.exists(path):
+            return version
+        # The form charts come from the analytics store, which the routes let
+        # lag behind writes; load one at least as new as the version first
+        try:
+            import analytics
+        except ImportError:
+            pass
+        else:
+            analytics.get_store(wait=True)
+        try:
+            html = view(**{f'{kind}_id': entity_id}).encode()
+        except NotFound:
+            return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # The plain file goes last: its presence means the whole set is written
+    _write(f'{path}.gz', gzip.compress(html, 9))
+    if brotli is not None:
+        _write(f'{path}.br', brotli.compress(html, quality=11))
+    _write(path, html)
+    for stale in glob.glob(os.path.join(ROOT, kind, f'{entity_id}.v*.html*')):
+        if not stale.startswith(path) and not stale.endswith('.tmp'):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+    render_seconds.observe(time.perf_counter() - started, kind)
+    return version
+
+def serve(kind, entity_id, version, accept_encodings):
+    # Response streaming the stored page for version, or None when it has not
+    # been rendered yet
+    path = page_path(kind, entity_id, version)
+    for encoding, suffix in (*ENCODINGS, (None, '')):
+        if encoding is not None and not accept_encodings[encoding]:
+            continue
+        try:
+            f = open(path + suffix, 'rb')
+        except FileNotFoundError:
+            if encoding is None:
+                served_total.inc(kind, 'miss')
+                return None
+            continue
+        if encoding is not None and not os.path.exists(path):
+            # A compressed copy without its plain file is still being written
+            f.close()
+            continue
+        # Passing the open file lets the server hand it to sendfile(), and a
+        # concurrent cleanup cannot pull it out from under the response
+        response = send_file(f, mimetype='text/html', conditional=False, etag=False)
+        response.content_length = os.fstat(f.fileno()).st_size
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        served_total.inc(kind, 'hit')
+        return response
+
+def schedule(tags):
+    # Queue the team and player pages among tags such as ('team', 3) for
+    # re-rendering; repeated writes to a page before it is rendered coalesce
+    if ROOT is None or _app is None:
+        return
+    pages = [(kind, entity_id) for kind, entity_id in tags if kind in VIEWS]
+    if not pages:
+        return
+    with _lock:
+        for page in pages:
+            _queue[page] = None
+        if _state['pid'] != os.getpid():
+            _state['pid'] = os.getpid()
+            threading.Thread(target=_run, name='prerender', daemon=True).start()
+    _wake.set()
+
+def _run():
+    while True:
+        _wake.wait()
+        _wake.clear()
+        while True:
+            with _lock:
+                if not _queue:
+                    break
+                page = next(iter(_queue))
+                del _queue[page]
+            try:
+                render(_app, *page)
+            except Exception:
+                # The route renders live until a later write queues the page again
+                _app.logger.exception('Prerendering %s %s failed', *page)
+
+def pending():
+    with _lock:
+        return len(_queue)
+
+def _reset_after_fork():
+    global _lock
+    _lock = threading.Lock()
+    _queue.clear()
+    _state['pid'] = None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _render_chunk(kind, ids):
+    from app import app
+    rendered = sum(render(app, kind, entity_id) is not None for entity_id in ids)
+    return len(ids), rendered
+
+def build(kinds=tuple(VIEWS), jobs=None, chunk_size=200):
+    # Render every page, spreading chunks of ids over a pool of processes
+    conn = get_db_connection()
+    chunks = []
+    for kind in kinds:
+        ids = [row[0] for row in conn.execute(f'SELECT id FROM {kind}s ORDER BY id')]
+        chunks.extend((kind, ids[i:i + chunk_size]) for i in range(0, len(ids), chunk_size))
+    done = rendered = 0
+    if not chunks:
+        return done, rendered
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for count, written in pool.map(_render_chunk, *zip(*chunks)):
+            done += count
+            rendered += written
+            print(f'\r{done} pages', end='', file=sys.stderr, flush=True)
+    print(file=sys.stderr)
+    return done, rendered
+
+def main(argv=None):
+    global ROOT
+    parser = argparse.ArgumentParser(description='Pre-render team and player dashboards')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    build_parser = subcommands.add_parser('build', help='render every dashboard page')
+    build_parser.add_argument('--out', default=ROOT, help='output directory (default CRICKET_PRERENDER)')
+    build_parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes')
+    build_parser.add_argument('--kind', choices=tuple(VIEWS), action='append',
+                              help='only this kind of page (repeatable)')
+    args = parser.parse_args(argv)
+    if not args.out:
+        parser.error('--out or CRICKET_PRERENDER is required')
+    # Worker processes read the output directory from the environment
+    os.environ['CRICKET_PRERENDER'] = ROOT = args.out
+    started = time.perf_counter()
+    done, rendered = build(tuple(args.kind or VIEWS), args.jobs)
+    print(f'{rendered} of {done} pages rendered in {time.perf_counter() - started:.1f}s')
+
+if __name__ == '__main__':
+    main()
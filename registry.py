@@ -0,0 +1,140 @@
+import threading
+from array import array
+
+import database
+
+# Team and player names held in process so hot queries need not join teams and
+# players just to label ids. Names of each kind are packed into one UTF-8
+# buffer addressed by id through an offsets array, plus a team id array for
+# players: a few bytes of overhead per player instead of a Python object each.
+#
+# Ids only ever grow, so the registry catches up with rows added elsewhere
+# (other workers, the importer) by reading ids above the highest it holds,
+# whenever it is asked for an id it has not seen yet.
+
+class NameTable:
+    __slots__ = ('_data', '_offsets', '_team_ids', 'max_id')
+
+    def __init__(self, with_teams=False):
+        self._data = bytearray()
+        # Name of id i is _data[_offsets[i]:_offsets[i + 1]]; ids never seen
+        # (or never committed) have an empty slice
+        self._offsets = array('Q', [0])
+        self._team_ids = array('i') if with_teams else None
+        self.max_id = 0
+
+    def append(self, entity_id, name, team_id=None):
+        # Ids arrive in ascending order; gaps are filled with empty names
+        end = len(self._data)
+        while self.max_id < entity_id - 1:
+            self._offsets.append(end)
+            if self._team_ids is not None:
+                self._team_ids.append(0)
+            self.max_id += 1
+        self._data += name.encode()
+        if self._team_ids is not None:
+            self._team_ids.append(team_id or 0)
+        self._offsets.append(len(self._data))
+        self.max_id = entity_id
+
+    def name(self, entity_id):
+        if not 0 < entity_id <= self.max_id:
+            return None
+        start, end = self._offsets[entity_id - 1], self._offsets[entity_id]
+        return self._data[start:end].decode() if end > start else None
+
+    def team_id(self, entity_id):
+        if not 0 < entity_id <= self.max_id:
+            return None
+        return self._team_ids[entity_id - 1] or None
+
+    def ids(self):
+        offsets = self._offsets
+        return [i for i in range(1, self.max_id + 1) if offsets[i] > offsets[i - 1]]
+
+    def nbytes(self):
+        size = len(self._data) + self._offsets.itemsize * len(self._offsets)
+        if self._team_ids is not None:
+            size += self._team_ids.itemsize * len(self._team_ids)
+        return size
+
+class Registry:
+    def __init__(self, database_path):
+        self.database = database_path
+        self.teams = NameTable()
+        self.players = NameTable(with_teams=True)
+        self._sorted_teams = None
+        self._lock = threading.Lock()
+
+    def catch_up(self, conn=None):
+        conn = conn or database.get_db_connection()
+        with self._lock:
+            rows = conn.execute('SELECT id, name FROM teams WHERE id > ? ORDER BY id',
+                                (self.teams.max_id,)).fetchall()
+            for team_id, name in rows:
+                self.teams.append(team_id, name)
+            if rows:
+                self._sorted_teams = None
+            for player_id, name, team_id in conn.execute('''
+                SELECT id, name, team_id FROM players WHERE id > ? ORDER BY id
+            ''', (self.players.max_id,)):
+                self.players.append(player_id, name, team_id)
+
+    def _known(self, table, entity_id):
+        # Anything but a positive integer id names no one: NULL, or the empty
+        # string older scorecards stored for a dismissal with no bowler picked
+        if not isinstance(entity_id, int) or entity_id <= 0:
+            return False
+        if entity_id > table.max_id:
+            self.catch_up()
+        return True
+
+    def team_name(self, team_id):
+        return self.teams.name(team_id) if self._known(self.teams, team_id) else None
+
+    def player_name(self, player_id):
+        return self.players.name(player_id) if self._known(self.players, player_id) else None
+
+    def player_team_id(self, player_id):
+        return self.players.team_id(player_id) if self._known(self.players, player_id) else None
+
+    def sorted_teams(self):
+        # [{'id', 'name'}] ordered by name, rebuilt only after new teams arrive
+        self.catch_up()
+        teams = self._sorted_teams
+        if teams is None:
+            teams = sorted(({'id': team_id, 'name': self.teams.name(team_id)} for team_id in self.teams.ids()),
+                           key=lambda team: team['name'])
+            self._sorted_teams = teams
+        return [dict(team) for team in teams]
+
+    def resolve(self, rows, teams=None, players=None):
+        # Rows as dicts with name columns filled in from id columns, e.g.
+        # resolve(rows, players={'bowler_name': 'bowler_id'})
+        rows = [dict(row) for row in rows]
+        for name_column, id_column in (teams or {}).items():
+            for row in rows:
+                row[name_column] = self.team_name(row[id_column])
+        for name_column, id_column in (players or {}).items():
+            for row in rows:
+                row[name_column] = self.player_name(row[id_column])
+        return rows
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    # Loaded on first use, and again if the app is pointed at another database
+    global _registry
+    registry = _registry
+    if registry is None or registry.database != database.DATABASE:
+        with _registry_lock:
+            registry = _registry
+            if registry is None or registry.database != database.DATABASE:
+                registry = Registry(database.DATABASE)
+                registry.catch_up()
+                _registry = registry
+    return registry
+
+def resolve(rows, teams=None, players=None):
+    return get_registry().resolve(rows, teams, players)
@@ -0,0 +1,207 @@
+import os
+import sqlite3
+import threading
+import time
+
+import database
+import metrics
+from cache import stats_cache
+
+# Read-only snapshot of the database for report and dashboard reads, copied
+# with the sqlite3 online backup API so heavy reads never hold up scorers
+# writing to the primary file. Off unless CRICKET_SNAPSHOT names the file.
+#
+# A refresher thread checks the primary's global data version every
+# CRICKET_SNAPSHOT_INTERVAL seconds, and sooner after CRICKET_SNAPSHOT_WRITES
+# writes, and copies it when the version moved. Reads use the snapshot only
+# while it was confirmed current within CRICKET_SNAPSHOT_MAX_AGE seconds;
+# otherwise, and for requests pinned to the primary (a client that just
+# wrote), they go to the primary.
+
+PATH = os.environ.get('CRICKET_SNAPSHOT') or None
+MAX_AGE = float(os.environ.get('CRICKET_SNAPSHOT_MAX_AGE', 30))
+INTERVAL = float(os.environ.get('CRICKET_SNAPSHOT_INTERVAL', 10))
+REFRESH_WRITES = int(os.environ.get('CRICKET_SNAPSHOT_WRITES', 200))
+
+reads_total = metrics.register(metrics.Counter('cricket_snapshot_reads_total',
+                                               'Report reads by the connection that served them', ('target',)))
+refreshes_total = metrics.register(metrics.Counter('cricket_snapshot_refreshes_total', 'Snapshot copies made'))
+refresh_seconds = metrics.register(metrics.Histogram('cricket_snapshot_refresh_seconds', 'Snapshot copy time'))
+
+def _age():
+    verified_at = _state['verified_at']
+    return {} if verified_at is None else {(): round(time.monotonic() - verified_at, 3)}
+
+age_gauge = metrics.register(metrics.Gauge('cricket_snapshot_age_seconds',
+                                           'Seconds since the snapshot was last confirmed current', (), _age))
+
+def _pending_writes():
+    snapshot = info()
+    return {(): snapshot['pending_writes']} if snapshot['enabled'] else {}
+
+pending_writes_gauge = metrics.register(metrics.Gauge('cricket_snapshot_pending_writes',
+                                                      'Writes not yet copied into the snapshot', (),
+                                                      _pending_writes))
+
+_local = threading.local()
+_state = {
+    'pid': None,
+    'thread': None,
+    'version': None,
+    'verified_at': None,
+    'writes': 0,
+    'tags': set(),
+}
+_lock = threading.Lock()
+_wake = threading.Event()
+
+def configure(path=None, max_age=None, interval=None, refresh_writes=None):
+    global PATH, MAX_AGE, INTERVAL, REFRESH_WRITES
+    if path is not None:
+        PATH = path or None
+    if max_age is not None:
+        MAX_AGE = max_age
+    if interval is not None:
+        INTERVAL = interval
+    if refresh_writes is not None:
+        REFRESH_WRITES = refresh_writes
+    with _lock:
+        _state.update(version=None, verified_at=None)
+
+def _global_version(conn):
+    row = conn.execute("SELECT version FROM data_versions WHERE scope = 'global'").fetchone()
+    return row[0] if row else 0
+
+def refresh():
+    # Copy the primary into a temporary file and swap it in atomically; readers
+    # still on the old file finish against it and reopen on their next checkout
+    with _lock:
+        tags, _state['tags'] = _state['tags'], set()
+        _state['writes'] = 0
+    started = time.perf_counter()
+    tmp_path = f'{PATH}.{os.getpid()}.tmp'
+    source = sqlite3.connect(database.DATABASE)
+    try:
+        target = sqlite3.connect(tmp_path)
+        try:
+            source.backup(target)
+            target.execute('PRAGMA journal_mode = DELETE')
+            version = _global_version(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+    os.replace(tmp_path, PATH)
+    with _lock:
+        _state.update(version=version, verified_at=time.monotonic())
+    # Reads of the old snapshot may have re-cached what these writes invalidated
+    stats_cache.invalidate(*tags)
+    refreshes_total.inc()
+    refresh_seconds.observe(time.perf_counter() - started)
+    return version
+
+def check():
+    # Refresh when the primary moved on, otherwise just confirm the snapshot is current
+    source = sqlite3.connect(database.DATABASE)
+    try:
+        version = _global_version(source)
+    finally:
+        source.close()
+    with _lock:
+        current = version == _state['version'] and os.path.exists(PATH)
+        if current:
+            _state['verified_at'] = time.monotonic()
+    if not current:
+        refresh()
+
+def _run():
+    while True:
+        _wake.wait(INTERVAL)
+        _wake.clear()
+        try:
+            check()
+        except (sqlite3.Error, OSError):
+            # Reads fall back to the primary once the snapshot ages out
+            pass
+
+def _ensure_started():
+    # The refresher is started lazily in each process, so a server that forks
+    # workers after importing the app gets one per worker
+    with _lock:
+        if _state['pid'] == os.getpid():
+            return
+        _state['pid'] = os.getpid()
+        _state['thread'] = threading.Thread(target=_run, name='snapshot-refresher', daemon=True)
+        _state['thread'].start()
+    _wake.set()
+
+def note_write(tags=()):
+    if PATH is None:
+        return
+    with _lock:
+        _state['writes'] += 1
+        _state['tags'].update(tags)
+        due = _state['writes'] >= REFRESH_WRITES
+    if due:
+        _wake.set()
+
+def pin_primary(pinned=True):
+    # Route this thread's reads to the primary until release()
+    _local.pinned = pinned
+
+def release(exception=None):
+    _local.pinned = False
+
+def is_pinned():
+    return getattr(_local, 'pinned', False)
+
+def is_fresh():
+    with _lock:
+        verified_at = _state['verified_at']
+    return verified_at is not None and time.monotonic() - verified_at <= MAX_AGE
+
+def get_read_connection():
+    if PATH is None:
+        return database.get_db_connection()
+    _ensure_started()
+    if is_pinned() or not is_fresh():
+        reads_total.inc('primary')
+        return database.get_db_connection()
+    try:
+        identity = os.stat(PATH)
+    except OSError:
+        reads_total.inc('primary')
+        return database.get_db_connection()
+    identity = (identity.st_ino, identity.st_mtime_ns)
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.identity != identity:
+        if conn is not None:
+            conn.close()
+        conn = database.connect_read_only(PATH)
+        _local.conn = conn
+        _local.identity = identity
+    reads_total.inc('snapshot')
+    return conn
+
+def _reset_after_fork():
+    # The child gets its own refresher and never touches the parent's snapshot
+    # connections
+    global _local, _lock
+    _local = threading.local()
+    _lock = threading.Lock()
+    _state.update(pid=None, thread=None)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def info():
+    with _lock:
+        verified_at = _state['verified_at']
+        return {
+            'enabled': PATH is not None,
+            'path': PATH,
+            'version': _state['version'],
+            'age': None if verified_at is None else round(time.monotonic() - verified_at, 3),
+            'max_age': MAX_AGE,
+            'pending_writes': _state['writes'],
+        }